@@ -0,0 +1,100 @@
+#
+import collections
+import threading
+
+
+class LRUCache:
+    """
+    Thread-safe LRU cache with a memory budget. Least recently used entries
+    are evicted, when the summed size of the cached values exceeds
+    `max_bytes` (larger values are not cached at all).
+
+    The size of a value is `value.nbytes` (`numpy` arrays); subclasses
+    override `size` for other values and wrap `get` and `put` to decide,
+    whether values are shared or copied.
+
+    Parameters:
+        :max_bytes: memory budget
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = collections.OrderedDict()  # key -> (value, size)
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        """Remove all entries and reset the statistics"""
+
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def size(self, value):
+        """Memory size of `value` (bytes)"""
+
+        return value.nbytes
+
+    def get(self, key):
+        """Cached value for `key` or None"""
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return entry[0]
+
+    def put(self, key, value):
+        """Insert `value` (replacing an entry of `key`)"""
+
+        nbytes = self.size(value)
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.nbytes -= old[1]
+            self._entries[key] = (value, nbytes)
+            self.nbytes += nbytes
+            while self.nbytes > self.max_bytes:
+                _, old = self._entries.popitem(last=False)
+                self.nbytes -= old[1]
+                self.evictions += 1
+
+    def stats(self):
+        """Dictionary of cache statistics"""
+
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.nbytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+class DefaultCache:
+    """
+    Replaceable default cache of a module's functions (None disables
+    caching), e.g. behind `mbeex.image.io.set_image_cache`.
+    """
+
+    def __init__(self, cache=None):
+        self.cache = cache
+
+    def set(self, cache):
+        """Set the default cache; returns the previous one"""
+
+        ret = self.cache
+        self.cache = cache
+        return ret
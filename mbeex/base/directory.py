@@ -1,7 +1,18 @@
+import collections
+import concurrent.futures
+import hashlib
+import itertools
+import json
 import os
 import os.path
+import shutil
+import tempfile
+import time
+import traceback
 from pathlib import Path
 
+from mbeex.base.progress import ProgressMeter
+
 
 def stem_name(file_name):
     """Return the files stem (string w/o directory and extension part)"""
@@ -13,42 +24,282 @@ def count_files(root):
     """Count all files in a directory tree."""
 
     ret = 0
-    for dirpath, dirs, files in os.walk(root):
-        for file in files:
-            ret += 1
+    for dirpath, dirs, files in walk_directory(root):
+        ret += len(files)
     return ret
 
 
-def filter_directory(root, filter, *args, print_progress=False):
+class WalkEstimate:
+    """
+    Running estimate of the number of files in a directory tree, refined while
+    `walk_directory` traverses it. The estimate extrapolates the mean number of
+    files per visited directory onto the directories still waiting in the queue.
+    It becomes exact, when the walk is `complete`.
+    """
+
+    def __init__(self):
+        self.files = 0
+        self.dirs_done = 0
+        self.dirs_pending = 1
+        self.complete = False
+
+    def total(self):
+        """Estimated total number of files (exact, if `self.complete`)"""
+
+        if self.complete or not self.dirs_done:
+            return self.files
+        mean = self.files / self.dirs_done
+        return self.files + int(round(mean * self.dirs_pending))
+
+    def discount(self, n):
+        """Exclude `n` already counted files (e.g. files of other shards)"""
+
+        self.files -= n
+
+
+def shard_of(rel_path, shard_count):
+    """
+    Stable shard index of a relative path (independent of machine, process
+    and platform: `os.sep` is mapped to '/'). Paths are spread uniformly
+    over `shard_count` shards by a hash.
+    """
+
+    key = rel_path.replace(os.sep, "/").encode("utf-8")
+    digest = hashlib.blake2b(key, digest_size=8).digest()
+    return int.from_bytes(digest, "little") % shard_count
+
+
+def _check_shard(shard_index, shard_count):
+    """Raises a `ValueError`, unless `shard_index` is a shard of `shard_count`"""
+
+    if not 0 <= shard_index < shard_count:
+        raise ValueError(f"invalid shard {shard_index} of {shard_count}")
+
+
+def _shard_files(root, dirpath, files, shard_index, shard_count):
+    """Subset of the names `files` in `dirpath` belonging to shard `shard_index`"""
+
+    rel = os.path.relpath(dirpath, root)
+    prefix = "" if rel == "." else rel + "/"
+    return [f for f in files if shard_of(prefix + f, shard_count) == shard_index]
+
+
+def scan_directory(top):
+    """
+    List a single directory with `os.scandir`.
+    Returns `(dirnames, filenames, links)`, where `links` is the set of
+    `dirnames` entries, which are symbolic links. Raises `OSError`.
+    """
+
+    dirs = []
+    files = []
+    links = set()
+    with os.scandir(top) as it:
+        for entry in it:
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            if not is_dir:
+                files.append(entry.name)
+                continue
+            dirs.append(entry.name)
+            try:
+                if entry.is_symlink():
+                    links.add(entry.name)
+            except OSError:
+                pass
+    return dirs, files, links
+
+
+def walk_directory(root, estimate=None):
+    """
+    Single pass, `os.scandir` based drop-in for `os.walk(root)` (top-down,
+    symbolic links to directories are not followed, unreadable directories are
+    skipped). Yields `(dirpath, dirnames, filenames)` in `os.walk` order;
+    `dirnames` may be pruned in place as with `os.walk`.
+
+    Parameters:
+        :root:      directory (string or Path object)
+        :estimate:  optional `WalkEstimate`, updated during the walk
+    """
+
+    stack = [os.fspath(root)]
+    while stack:
+        top = stack.pop()
+        try:
+            dirs, files, links = scan_directory(top)
+        except OSError:
+            if estimate is not None:
+                estimate.dirs_pending -= 1
+            continue
+        if estimate is not None:
+            estimate.files += len(files)
+            estimate.dirs_done += 1
+            estimate.dirs_pending -= 1
+        yield top, dirs, files
+        subdirs = [os.path.join(top, d) for d in dirs if d not in links]
+        if estimate is not None:
+            estimate.dirs_pending += len(subdirs)
+        stack.extend(reversed(subdirs))
+    if estimate is not None:
+        estimate.complete = True
+
+
+def _progress_meter(progress, label):
+    """
+    Returns the `ProgressMeter` for a `print_progress` argument: a meter
+    instance is restarted and used, True creates a console meter.
+    Returns None for False.
+    """
+
+    if isinstance(progress, ProgressMeter):
+        progress.start()
+        return progress
+    if progress:
+        return ProgressMeter(label)
+    return None
+
+
+def _job_meter(progress, label):
+    """Like `_progress_meter`, but returns a silent meter for False"""
+
+    meter = _progress_meter(progress, label)
+    if meter is None:
+        meter = ProgressMeter(label, output=False, measure_bytes=False)
+    return meter
+
+
+def _update_progress(meter, estimate, files=1, nbytes=0, latency=None, errors=0):
+    meter.setTotal(estimate.total(), not estimate.complete)
+    meter.update(files, nbytes, latency, errors)
+
+
+def _finish_progress(meter, estimate):
+    meter.setTotal(estimate.total(), not estimate.complete)
+    return meter.finish()
+
+
+def _account_tasks(meter, estimate, chunk):
+    """Account finished `(key, success, value, latency, nbytes)` tasks"""
+
+    for key, success, _, latency, nbytes in chunk:
+        files = 1 if isinstance(key, (str, os.PathLike)) else len(key)
+        nbytes = nbytes if success else 0
+        _update_progress(meter, estimate, files, nbytes, latency, int(not success))
+
+
+def _file_size(key):
+    """Size of a file or the summed size of a list of files (0, if inaccessible)"""
+
+    if not isinstance(key, (str, os.PathLike)):
+        return sum(_file_size(k) for k in key)
+    try:
+        return os.path.getsize(key)
+    except OSError:
+        return 0
+
+
+def iter_directory(
+    root, filter, *args, print_progress=False, shard_index=0, shard_count=1
+):
+    """
+    Lazily yield the file names below root, which pass a
+    filter function (or functor - overload `__call__`)
+    `filter(file_name, *args) -> bool`
+
+    The tree is walked once; stop iterating to stop the walk. Progress
+    output is based on a running estimate of the total file count.
+    `print_progress` may also be a `ProgressMeter`.
+
+    For `filter == None`, every file will be returned. A `CompiledFileFilter`
+    is applied to whole directories at once.
+
+    For `shard_count > 1`, only files of shard `shard_index` (see `shard_of`,
+    applied to the path relative to `root`) are considered; the union of all
+    shards equals the unsharded result. Invalid shards raise a `ValueError`
+    (immediately, not on iteration).
+    """
+
+    _check_shard(shard_index, shard_count)
+    return _iter_directory(root, filter, args, print_progress, shard_index, shard_count)
+
+
+def _iter_directory(root, filter, args, print_progress, shard_index, shard_count):
+    estimate = WalkEstimate()
+    meter = _progress_meter(print_progress, "Filtering directory tree")
+    batch = isinstance(filter, CompiledFileFilter) and not args
+    try:
+        for dirpath, dirs, files in walk_directory(root, estimate):
+            if shard_count > 1:
+                n = len(files)
+                files = _shard_files(root, dirpath, files, shard_index, shard_count)
+                estimate.discount(n - len(files))
+            if batch:
+                if meter is not None:
+                    _update_progress(meter, estimate, len(files))
+                yield from filter.filterMany(
+                    [os.path.join(dirpath, file) for file in files]
+                )
+                continue
+            for file in files:
+                ifile = os.path.join(dirpath, file)
+                if meter is not None:
+                    _update_progress(meter, estimate)
+                if filter == None or filter(ifile, *args):
+                    yield ifile
+    finally:
+        if meter is not None:
+            _finish_progress(meter, estimate)
+
+
+def filter_directory(
+    root,
+    filter,
+    *args,
+    print_progress=False,
+    cache_dir=None,
+    shard_index=0,
+    shard_count=1,
+):
     """
     Return a subset of file names below root, using a
     filter function (or functor - overload `__call__`)
     `filter(file_name, *args) -> bool`
     
     For `filter == None`, every file will be returned.
+    See `iter_directory` for a lazy variant.
+
+    With `cache_dir`, the listing is taken from a persistent
+    `mbeex.base.index.DirectoryIndex` stored there (only changed directories
+    are listed again; the result is sorted by directory and name).
+    See `iter_directory` for sharding.
     """
 
-    all = count_files(root)
-    cnt = 0
-    percent = 0
-    old_percent = 0
-    ret = []
-    for dirpath, dirs, files in os.walk(root):
-        for file in files:
-            ifile = os.path.join(dirpath, file)
-            if print_progress == True:
-                cnt += 1
-                percent = (100 * cnt) // all
-                print(
-                    f"Filtering directory tree: {percent}% ({cnt}/{all} files)",
-                    end="\r",
-                )
-                percent = old_percent
-            if filter == None or filter(ifile, *args):
-                ret.append(ifile)
-    if print_progress == True:
-        print("")
-    return ret
+    if cache_dir is not None:
+        from mbeex.base.index import DirectoryIndex
+
+        _check_shard(shard_index, shard_count)
+
+        with DirectoryIndex(root, cache_dir) as index:
+            ret = index.query(filter, *args)
+        if shard_count > 1:
+            ret = [
+                f
+                for f in ret
+                if shard_of(os.path.relpath(f, root), shard_count) == shard_index
+            ]
+        return ret
+    return list(
+        iter_directory(
+            root,
+            filter,
+            *args,
+            print_progress=print_progress,
+            shard_index=shard_index,
+            shard_count=shard_count,
+        )
+    )
 
 
 def replicate_dir(iroot, relpath, oroot):
@@ -60,21 +311,299 @@ def replicate_dir(iroot, relpath, oroot):
 
     structure = os.path.join(oroot, os.path.relpath(relpath, iroot))
     if not os.path.isdir(structure):
-        os.makedirs(structure)
+        os.makedirs(structure, exist_ok=True)  # concurrent walkers (shards)
     return structure
 
 
+class WalkReport:
+    """
+    Outcome of a `DirectoryWalker` job.
+
+    Attributes:
+        :results: list of `(key, result)` for every call returning something
+                  other than `None` (`key` is the first argument passed to
+                  the functor, i.e. the input file or the list of input files)
+        :errors:  list of `(key, traceback string)` for every failed call
+        :count:   number of functor calls
+        :skipped: number of up-to-date files skipped (incremental mode)
+        :incomplete: incomplete file groups skipped (`FileGrouper`)
+        :summary: `mbeex.base.progress.JobSummary` (throughput, latencies)
+    """
+
+    def __init__(self):
+        self.results = []
+        self.errors = []
+        self.count = 0
+        self.skipped = 0
+        self.incomplete = []
+        self.summary = None
+
+    def ok(self):
+        """True, if no call failed"""
+
+        return not self.errors
+
+    def add(self, key, success, value):
+        self.count += 1
+        if not success:
+            self.errors.append((key, value))
+        elif value is not None:
+            self.results.append((key, value))
+
+
+def _apply_chunk(func, chunk, args, measure=False):
+    """
+    Worker side: call `func(*task, *args)` for all tasks of a chunk, never
+    raise. With `measure`, the input size is determined here, too.
+    """
+
+    ret = []
+    for task in chunk:
+        nbytes = _file_size(task[0]) if measure else 0
+        t0 = time.perf_counter()
+        try:
+            value = func(*task, *args)
+            success = True
+        except Exception:
+            value = traceback.format_exc()
+            success = False
+        ret.append((task[0], success, value, time.perf_counter() - t0, nbytes))
+    return ret
+
+
+def _make_executor(executor, workers):
+    """Returns `(executor, owned)` for the `executor`/`workers` options"""
+
+    if isinstance(executor, concurrent.futures.Executor):
+        return executor, False
+    if executor in (None, "process"):
+        return concurrent.futures.ProcessPoolExecutor(workers or None), True
+    if executor == "thread":
+        return concurrent.futures.ThreadPoolExecutor(workers or None), True
+    raise ValueError(f"unknown executor: {executor}")
+
+
+def _execute(
+    func,
+    tasks,
+    args,
+    workers,
+    executor,
+    chunksize,
+    ordered,
+    max_pending,
+    done=None,
+    measure=False,
+):
+    """
+    Apply `func(*task, *args)` to every task of the iterable `tasks`, either
+    serially (no `workers` and no `executor`; exceptions propagate) or in an
+    executor (errors are collected per task). Returns a `WalkReport`.
+    `done(chunk)` is called with the `(key, success, value, latency, nbytes)`
+    tuples of finished tasks; the input size `nbytes` is only determined
+    with `measure` (by the workers), otherwise it is 0.
+    """
+
+    report = WalkReport()
+    if not workers and executor is None:
+        for task in tasks:
+            nbytes = _file_size(task[0]) if measure else 0
+            t0 = time.perf_counter()
+            value = func(*task, *args)
+            report.add(task[0], True, value)
+            if done:
+                done([(task[0], True, value, time.perf_counter() - t0, nbytes)])
+        return report
+
+    pool, owned = _make_executor(executor, workers)
+    if not max_pending:
+        max_pending = 2 * (workers or os.cpu_count() or 1)
+    pending = collections.deque()
+
+    def collect(future):
+        chunk = future.result()
+        for key, success, value, _, _ in chunk:
+            report.add(key, success, value)
+        if done:
+            done(chunk)
+
+    def drain(limit):
+        while len(pending) > limit:
+            if ordered:
+                collect(pending.popleft())
+                continue
+            finished, _ = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in finished:
+                pending.remove(future)
+                collect(future)
+
+    try:
+        chunk = []
+        for task in tasks:
+            chunk.append(task)
+            if len(chunk) >= chunksize:
+                drain(max_pending - 1)
+                pending.append(pool.submit(_apply_chunk, func, chunk, args, measure))
+                chunk = []
+        if chunk:
+            drain(max_pending - 1)
+            pending.append(pool.submit(_apply_chunk, func, chunk, args, measure))
+        drain(0)
+    finally:
+        for future in pending:
+            future.cancel()
+        if owned:
+            pool.shutdown()
+    return report
+
+
+def prefetch_file(ifile, block_size=1 << 20):
+    """
+    Read `ifile` completely and discard the content. Subsequent reads
+    are served from the OS page cache. Returns None.
+    """
+
+    with open(ifile, "rb") as fh:
+        while fh.read(block_size):
+            pass
+
+
+def _read_sized(read, ifile, measure):
+    """Reader side: `(read(ifile), size of ifile)` (size 0 without `measure`)"""
+
+    return read(ifile), _file_size(ifile) if measure else 0
+
+
+def _move_files(src_dir, dst_dir):
+    """Move all files of `src_dir` into `dst_dir` and remove `src_dir`"""
+
+    for name in os.listdir(src_dir):
+        shutil.move(os.path.join(src_dir, name), os.path.join(dst_dir, name))
+    os.rmdir(src_dir)
+
+
+class Manifest:
+    """
+    Make-style record of the source files processed into a destination tree,
+    stored as JSON lines in `dst_dir/MANIFEST_NAME`. Every entry holds the
+    source's modification time, size and a filter version. Entries are
+    appended (and flushed) as soon as a file is done, so an interrupted job
+    can be resumed; `close` compacts the file.
+
+    Parameters:
+        :dst_dir: destination directory
+        :version: filter version (any JSON serializable value, compared in
+                  its JSON form, e.g. tuples as lists); entries of other
+                  versions are outdated
+        :name:    manifest file name (default: `MANIFEST_NAME`)
+    """
+
+    MANIFEST_NAME = ".mbeex_manifest"
+
+    def __init__(self, dst_dir, version=None, name=None):
+        self.path = os.path.join(dst_dir, name or Manifest.MANIFEST_NAME)
+        self.version = json.loads(json.dumps(version))  # as read back
+        self._entries = {}
+        self._seen = set()
+        self._file = None
+        self.load()
+
+    def load(self):
+        """(Re)read the manifest file, ignoring a truncated last line"""
+
+        self._entries = {}
+        if not os.path.isfile(self.path):
+            return
+        with open(self.path, "r", encoding="utf-8") as fh:
+            for line in fh:
+                try:
+                    entry = json.loads(line)
+                    self._entries[entry["src"]] = entry
+                except (ValueError, KeyError):
+                    continue
+
+    @staticmethod
+    def signature(ifile):
+        """Returns `(mtime_ns, size)` of `ifile`"""
+
+        st = os.stat(ifile)
+        return st.st_mtime_ns, st.st_size
+
+    def upToDate(self, rel, sig, ofile):
+        """
+        Check, if source `rel` (relative path) with signature `sig` has already
+        been processed by the current filter version into (existing) `ofile`.
+        """
+
+        self._seen.add(rel)
+        entry = self._entries.get(rel)
+        if entry is None:
+            return False
+        if [entry.get("mtime"), entry.get("size")] != list(sig):
+            return False
+        if entry.get("version") != self.version:
+            return False
+        return not entry.get("out") or os.path.exists(ofile)
+
+    def record(self, rel, sig, ofile):
+        """Mark `rel` (relative path) with signature `sig` as processed"""
+
+        entry = {
+            "src": rel,
+            "mtime": sig[0],
+            "size": sig[1],
+            "version": self.version,
+            "out": os.path.exists(ofile),
+        }
+        self._entries[rel] = entry
+        self._seen.add(rel)
+        if self._file is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._file = open(self.path, "a", encoding="utf-8")
+        self._file.write(json.dumps(entry) + "\n")
+        self._file.flush()
+
+    def close(self, compact=True):
+        """
+        Close the manifest. With `compact == True` it is rewritten, keeping
+        only sources seen since construction (drops deleted sources).
+        """
+
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if not compact or not os.path.isfile(self.path):
+            return
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as fh:
+            for rel, entry in self._entries.items():
+                if rel in self._seen:
+                    fh.write(json.dumps(entry) + "\n")
+        os.replace(tmp, self.path)
+
+
 class DirectoryWalker:
     """
     Generic directory walker (reading or/and writing)
+
+    The functors can be executed in parallel (`workers`, `executor` options of
+    `createFilteredData` and `run`). Process pools require picklable functors
+    and arguments (module level functions or instances of module level classes).
+
+    The work can be split over several machines with `setShard`.
     
     Parameters:
         :src: source directory
-        :dst: destination directory
+        :dst: destination directory (None for read only walks, see `run`)
+        :shard_index: see `setShard`
+        :shard_count: see `setShard`
     """
 
-    def __init__(self, src, dst):
+    def __init__(self, src, dst, shard_index=0, shard_count=1):
         self.setDirectories(src, dst)
+        self.setShard(shard_index, shard_count)
 
     def setDirectories(self, src, dst):
         """
@@ -88,50 +617,341 @@ class DirectoryWalker:
         self.src_dir = src
         self.dst_dir = dst
 
-    def createFilteredData(self, filter, *args):
+    def setShard(self, shard_index, shard_count):
+        """
+        Restrict walking to a deterministic slice of the source files: shard
+        `shard_index` of `shard_count` (see `shard_of`, applied to the path
+        relative to `self.src_dir`; `multiple` mode shards whole directories).
+        Every shard replicates the complete directory structure, so the union
+        of all shards' output equals an unsharded run.
+        """
+
+        _check_shard(shard_index, shard_count)
+        self.shard_index = shard_index
+        self.shard_count = shard_count
+
+    def _walk(self, estimate, by_directory=False):
+        """
+        Walk `self.src_dir`, replicate directories in `self.dst_dir` and yield
+        `(dirpath, structure, files)` with the files of this walker's shard
+        (all files of the directories of this shard for `by_directory`).
+        Without `self.dst_dir`, nothing is replicated and `structure` is None.
+        """
+
+        sharded = self.shard_count > 1
+        for dirpath, dirs, files in walk_directory(self.src_dir, estimate):
+            structure = None
+            if self.dst_dir is not None:
+                structure = replicate_dir(self.src_dir, dirpath, self.dst_dir)
+            n = len(files)
+            if sharded and by_directory:
+                rel = os.path.relpath(dirpath, self.src_dir)
+                if shard_of(rel, self.shard_count) != self.shard_index:
+                    files = []
+            elif sharded:
+                files = _shard_files(
+                    self.src_dir, dirpath, files, self.shard_index, self.shard_count
+                )
+            estimate.discount(n - len(files))
+            yield dirpath, structure, files
+
+    def createFilteredData(
+        self,
+        filter,
+        *args,
+        workers=0,
+        executor=None,
+        chunksize=1,
+        ordered=False,
+        max_pending=None,
+        incremental=False,
+        version=None,
+        print_progress=True,
+    ):
         """
         Duplicate `self.src_dir` into identical
         tree structure in `self.dst_dir` with the contained files transformed
         using a filter function (or functor [overload `__call__`])
         `filter(ifile, ofile, *args)`
+
+        In incremental mode, processed files are recorded in a `Manifest` in
+        `self.dst_dir`. A rerun (also of an interrupted job) only processes
+        new or changed sources (modification time, size or filter version
+        differ, or the recorded output is missing).
+
+        Parameters:
+            :workers:     number of parallel workers (0: serial execution)
+            :executor:    "process" (default for `workers > 0`), "thread" or
+                          a `concurrent.futures.Executor` instance (not shut down)
+            :chunksize:   number of files submitted to a worker at once
+            :ordered:     keep `WalkReport.results` in walk order
+            :max_pending: maximum number of chunks in flight (default: 2*workers)
+            :incremental: skip files, which are up to date according to the manifest
+            :version:     filter version for the manifest (default: `filter.version`,
+                          if existing)
+            :print_progress: progress output (bool or `ProgressMeter`)
+            :return:      `WalkReport`; in parallel mode failing files are
+                          reported there instead of aborting the walk
         """
 
-        all = count_files(self.src_dir)
-        cnt = 0
-        percent = 0
-        old_percent = 0
-        print(f"Progress: {percent}% ({cnt}/{all} files)", end="\r")
-        for dirpath, dirs, files in os.walk(self.src_dir):
-            structure = replicate_dir(self.src_dir, dirpath, self.dst_dir)
-            for file in files:
-                ifile = os.path.join(dirpath, file)
-                ofile = os.path.join(structure, file)
-                filter(ifile, ofile, *args)
-                cnt += 1
-                percent = (100 * cnt) // all
-                print(f"Progress: {percent}% ({cnt}/{all} files)", end="\r")
-                percent = old_percent
+        estimate = WalkEstimate()
+        meter = _job_meter(print_progress, "Progress")
+        skipped = 0
+        manifest = None
+        pending = {}  # ifile -> (relative path, signature, ofile)
+        if incremental:
+            if version is None:
+                version = getattr(filter, "version", None)
+            name = None
+            if self.shard_count > 1:
+                shard = f"{self.shard_index}of{self.shard_count}"
+                name = f"{Manifest.MANIFEST_NAME}.{shard}"
+            manifest = Manifest(self.dst_dir, version, name)
+
+        def tasks():
+            nonlocal skipped
+            for dirpath, structure, files in self._walk(estimate):
+                for file in files:
+                    ifile = os.path.join(dirpath, file)
+                    ofile = os.path.join(structure, file)
+                    if manifest is not None:
+                        rel = os.path.relpath(ifile, self.src_dir).replace(os.sep, "/")
+                        sig = Manifest.signature(ifile)
+                        if manifest.upToDate(rel, sig, ofile):
+                            skipped += 1
+                            _update_progress(meter, estimate)
+                            continue
+                        pending[ifile] = (rel, sig, ofile)
+                    yield ifile, ofile
+
+        def done(chunk):
+            if manifest is not None:
+                sized = []
+                for ifile, success, value, latency, _ in chunk:
+                    rel, sig, ofile = pending.pop(ifile)
+                    if success:
+                        manifest.record(rel, sig, ofile)
+                    # the signature holds the size, workers need not measure it
+                    nbytes = sig[1] if meter.measure_bytes else 0
+                    sized.append((ifile, success, value, latency, nbytes))
+                chunk = sized
+            _account_tasks(meter, estimate, chunk)
+
+        try:
+            report = _execute(
+                filter,
+                tasks(),
+                args,
+                workers,
+                executor,
+                chunksize,
+                ordered,
+                max_pending,
+                done,
+                meter.measure_bytes and manifest is None,
+            )
+            report.skipped = skipped
+        finally:
+            if manifest is not None:
+                # keep entries of unvisited sources, if the walk was interrupted
+                manifest.close(compact=estimate.complete)
+        report.summary = _finish_progress(meter, estimate)
+        return report
 
-    def run(self, f, multiple=False):
+    def createPipelinedData(
+        self,
+        filter,
+        *args,
+        read=None,
+        write=None,
+        prefetch=8,
+        readers=2,
+        writers=2,
+        max_writes=8,
+        spool_dir=None,
+        print_progress=True,
+    ):
+        """
+        Pipelined variant of `createFilteredData`: reading sources (reader
+        threads), the filter (calling thread) and writing results (writer
+        threads) overlap. At most `prefetch` files are read ahead and at most
+        `max_writes` results wait for writing.
+
+        Without `read` and `write`, the usual filter `filter(ifile, ofile, *args)`
+        is used unchanged: the readers prefetch every source into the OS page
+        cache, `ofile` is located in a local spool directory and the writers
+        move all files the filter created there into the destination directory
+        (so a filter may also write files with a different name next to `ofile`).
+
+        With `read` and `write` the stages are explicit:
+        `data = read(ifile)`, `result = filter(data, *args)` and
+        `write(ofile, result)`. Passing only one of them raises a `ValueError`.
+
+        Parameters:
+            :read:       reader stage function (default: spool mode, see above)
+            :write:      writer stage function (default: spool mode, see above)
+            :prefetch:   maximum number of sources read ahead
+            :readers:    number of reader threads
+            :writers:    number of writer threads
+            :max_writes: maximum number of pending writes
+            :spool_dir:  directory for spooled outputs (default: temporary directory)
+            :print_progress: progress output (bool or `ProgressMeter`)
+            :return:     `WalkReport` (failures of any stage are reported per file);
+                         latencies in the summary are filter latencies
+        """
+
+        if (read is None) != (write is None):
+            raise ValueError(
+                "createPipelinedData requires both or neither of read and write"
+            )
+        estimate = WalkEstimate()
+        meter = _job_meter(print_progress, "Progress")
+        report = WalkReport()
+        spool = None
+        if write is None:
+            spool = tempfile.mkdtemp(prefix="mbeex_spool_", dir=spool_dir)
+            read = prefetch_file
+        reading = collections.deque()
+        writing = collections.deque()
+        numbers = itertools.count()
+
+        def tasks():
+            for dirpath, structure, files in self._walk(estimate):
+                for file in files:
+                    yield os.path.join(dirpath, file), os.path.join(structure, file)
+
+        def finish(ifile, success, value, latency=None, nbytes=0):
+            report.add(ifile, success, value)
+            _account_tasks(meter, estimate, [(ifile, success, value, latency, nbytes)])
+
+        def finish_writes(limit):
+            while len(writing) > limit:
+                ifile, future, result, latency, nbytes = writing.popleft()
+                try:
+                    future.result()
+                except Exception:
+                    finish(ifile, False, traceback.format_exc())
+                    continue
+                finish(ifile, True, result, latency, nbytes)
+
+        def compute(ifile, ofile, future):
+            try:
+                data, nbytes = future.result()
+                t0 = time.perf_counter()
+                if spool is None:
+                    result = filter(data, *args)
+                    job = (write, ofile, result)
+                else:
+                    tmp = os.path.join(spool, str(next(numbers)))
+                    os.mkdir(tmp)
+                    result = filter(
+                        ifile, os.path.join(tmp, os.path.basename(ofile)), *args
+                    )
+                    job = (_move_files, tmp, os.path.dirname(ofile))
+                latency = time.perf_counter() - t0
+            except Exception:
+                finish(ifile, False, traceback.format_exc())
+                return
+            finish_writes(max_writes - 1)
+            writing.append((ifile, wpool.submit(*job), result, latency, nbytes))
+
+        rpool = concurrent.futures.ThreadPoolExecutor(readers)
+        wpool = concurrent.futures.ThreadPoolExecutor(writers)
+        try:
+            for ifile, ofile in tasks():
+                if len(reading) >= prefetch:
+                    compute(*reading.popleft())
+                future = rpool.submit(_read_sized, read, ifile, meter.measure_bytes)
+                reading.append((ifile, ofile, future))
+            while reading:
+                compute(*reading.popleft())
+            finish_writes(0)
+        finally:
+            for entry in reading:
+                entry[2].cancel()
+            rpool.shutdown()
+            wpool.shutdown()
+            if spool is not None:
+                shutil.rmtree(spool, ignore_errors=True)
+        report.summary = _finish_progress(meter, estimate)
+        return report
+
+    def run(
+        self,
+        f,
+        multiple=False,
+        workers=0,
+        executor=None,
+        chunksize=1,
+        ordered=False,
+        max_pending=None,
+        print_progress=False,
+        grouper=None,
+    ):
         """
         Traverse `self.src_dir` directory tree, recreate mirror tree in self.dst_dir on the fly and apply
         functor `f` to every allowed source file. `f` can map files 1:1 and n:1
+        (`multiple == True`: one call per directory with the files selected
+        by `f.selectInputFiles`). See `createFilteredData` for the
+        parallel execution and progress options; returns a `WalkReport`.
+
+        Without a destination directory (`self.dst_dir` is None), no tree is
+        replicated and `f` receives None instead of the output directory.
+
+        With a `FileGrouper` as `grouper`, `multiple` mode calls `f` once
+        per file group (instead of using `f.selectInputFiles`). Skipped
+        incomplete groups are listed in `WalkReport.incomplete`.
         """
 
-        for curpath, subdirs, files in os.walk(self.src_dir):
-            structure = replicate_dir(self.src_dir, curpath, self.dst_dir)
-            if not multiple:
-                for file in files:
-                    ifile = os.path.normpath(os.path.join(curpath, file))
-                    f(ifile, structure)
-            else:
-                if files:
-                    ifiles = f.selectInputFiles(files)
-                    ifiles = [
-                        os.path.normpath(os.path.join(curpath, ifile))
-                        for ifile in ifiles
-                    ]
-                    f(ifiles, structure)
+        estimate = WalkEstimate()
+        meter = _job_meter(print_progress, "Progress")
+        incomplete = []
+
+        def tasks():
+            for curpath, structure, files in self._walk(estimate, multiple):
+                if not multiple:
+                    for file in files:
+                        ifile = os.path.normpath(os.path.join(curpath, file))
+                        yield ifile, structure
+                elif grouper is not None:
+                    complete, partial = grouper.groups(files)
+                    if grouper.incomplete == "keep":
+                        complete, partial = complete + partial, []
+                    for group in partial:
+                        incomplete.append(
+                            [os.path.normpath(os.path.join(curpath, i)) for i in group]
+                        )
+                    for group in complete:
+                        yield [
+                            os.path.normpath(os.path.join(curpath, i)) for i in group
+                        ], structure
+                else:
+                    if files:
+                        ifiles = f.selectInputFiles(files)
+                        ifiles = [
+                            os.path.normpath(os.path.join(curpath, ifile))
+                            for ifile in ifiles
+                        ]
+                        yield ifiles, structure
+
+        def done(chunk):
+            _account_tasks(meter, estimate, chunk)
+
+        report = _execute(
+            f,
+            tasks(),
+            (),
+            workers,
+            executor,
+            chunksize,
+            ordered,
+            max_pending,
+            done,
+            meter.measure_bytes,
+        )
+        report.incomplete = incomplete
+        report.summary = _finish_progress(meter, estimate)
+        return report
 
 
 class FileFilter:
@@ -198,14 +1018,12 @@ class FileFilter:
 
         if not self.valid_suffixes:
             return ""
+        pf = Path(file)
+        n = pf.stem
         for s in self.valid_suffixes:
-            n = stem_name(file)
             if n.endswith(s):
                 n = n[: -len(s)] + new_suffix
-                pf = Path(file)
-                dir = pf.parents[0]
-                ext = pf.suffix
-                return str(dir / Path(n)) + ext
+                return str(pf.parents[0] / n) + pf.suffix
         return ""
 
     def validSuffix(self, file):
@@ -225,3 +1043,280 @@ class FileFilter:
         """
 
         return self.validSuffix(file) and self.validExtension(file)
+
+    def filterMany(self, files):
+        """
+        Return the list of `files` with valid extension and suffix.
+        """
+
+        return self.compile().filterMany(files)
+
+    def compile(self):
+        """
+        Return a `CompiledFileFilter` snapshot of the current settings
+        for fast repeated checks.
+        """
+
+        return CompiledFileFilter(self.valid_extensions, self.valid_suffixes)
+
+
+def _endings(endings):
+    """
+    Group string endings by length: `{length: frozenset(endings)}`.
+    `name[-length:] in group` then replaces one `endswith` call per ending.
+    """
+
+    ret = {}
+    for e in endings:
+        ret.setdefault(len(e), set()).add(e)
+    return {n: frozenset(group) for n, group in sorted(ret.items())}
+
+
+class CompiledFileFilter:
+    """
+    Immutable, precompiled form of a `FileFilter` (see `FileFilter.compile`)
+    with the same results. Extensions and suffixes are kept in frozen sets
+    grouped by length, so a check costs one set lookup per distinct length
+    instead of one comparison per list entry.
+
+    Instances are callable (`filter(file) -> bool`) and can be passed
+    to `filter_directory` and `iter_directory` directly.
+    """
+
+    def __init__(self, valid_extensions=None, valid_suffixes=None):
+        self.valid_extensions = tuple(valid_extensions or ())
+        self.valid_suffixes = tuple(valid_suffixes or ())
+        self._extensions = _endings("." + ext for ext in self.valid_extensions)
+        self._suffixes = _endings(s for s in self.valid_suffixes if s)
+        self._any_suffix = "" in self.valid_suffixes
+        self._suffix_order = {}
+        for i, s in enumerate(self.valid_suffixes):
+            self._suffix_order.setdefault(s, i)
+
+    def __call__(self, file):
+        return self.validFileName(file)
+
+    def validExtension(self, file):
+        """
+        Check, if the file has a valid extension.
+        """
+
+        if not self.valid_extensions:
+            return True
+        lower = file.lower()
+        for n, group in self._extensions.items():
+            if lower[-n:] in group:
+                return True
+        return False
+
+    def _validStem(self, root):
+        if self._any_suffix:
+            return True
+        for n, group in self._suffixes.items():
+            if root[-n:] in group:
+                return True
+        return False
+
+    def validSuffix(self, file):
+        """
+        Check, if the file has a valid suffix.
+        """
+
+        if not self.valid_suffixes:
+            return True
+        return self._validStem(os.path.splitext(file)[0])
+
+    def validFileName(self, file):
+        """
+        Check, if the file has valid extension and suffix.
+        """
+
+        return self.validSuffix(file) and self.validExtension(file)
+
+    def matchingSuffix(self, stem):
+        """
+        Return the first entry of `valid_suffixes` (in list order) `stem` ends
+        with or None.
+        """
+
+        if not self.valid_suffixes:
+            return None
+        found = None
+        for n, group in self._suffixes.items():
+            s = stem[-n:]
+            if s in group and (
+                found is None or self._suffix_order[s] < self._suffix_order[found]
+            ):
+                found = s
+        if self._any_suffix and (
+            found is None or self._suffix_order[""] < self._suffix_order[found]
+        ):
+            found = ""
+        return found
+
+    def replaceSuffix(self, file, new_suffix):
+        """
+        If `file` ends with a valid suffix the function returns
+        a new file name with this suffix replaced by new_suffix.
+        Otherwise an empty string is returned
+        """
+
+        pf = Path(file)
+        n = pf.stem
+        s = self.matchingSuffix(n)
+        if s is None:
+            return ""
+        n = n[: -len(s)] + new_suffix
+        return str(pf.parents[0] / n) + pf.suffix
+
+    def filterMany(self, files):
+        """
+        Return the list of `files` with valid extension and suffix.
+        """
+
+        if not self.valid_extensions and not self.valid_suffixes:
+            return list(files)
+        splitext = os.path.splitext
+        ret = []
+        for file in files:
+            if self.valid_suffixes and not self._validStem(splitext(file)[0]):
+                continue
+            if self.validExtension(file):
+                ret.append(file)
+        return ret
+
+
+class FileGrouper:
+    """
+    n:1 grouping of the files of a directory by their common stem, i.e. the
+    files stem without its valid suffix (see `FileFilter`).
+
+    Example:
+        suffix list   : ['_PARTS', '_PARTS_BB', '_ST']
+        files         : X_PARTS.png, X_PARTS_BB.xml, X_ST.png, Y_ST.png
+        groups        : [X_PARTS.png, X_PARTS_BB.xml, X_ST.png], [Y_ST.png]
+
+    Files are bucketed in a single pass. The suffix of a file is determined
+    like in `FileFilter.replaceSuffix` (first matching entry of the suffix
+    list). Files within a group are ordered by suffix list position and name.
+
+    Parameters:
+        :file_filter: `FileFilter` or `CompiledFileFilter` (suffixes, extensions)
+        :required:    suffixes, which a complete group must contain
+                      (default: all valid suffixes)
+        :incomplete:  "skip" (default) or "keep" incomplete groups
+    """
+
+    def __init__(self, file_filter, required=None, incomplete="skip"):
+        if not isinstance(file_filter, CompiledFileFilter):
+            file_filter = file_filter.compile()
+        if not file_filter.valid_suffixes:
+            raise ValueError("FileGrouper requires valid suffixes")
+        if incomplete not in ("skip", "keep"):
+            raise ValueError(f"invalid incomplete group policy: {incomplete}")
+        self._filter = file_filter
+        self._order = {}
+        for i, s in enumerate(file_filter.valid_suffixes):
+            self._order.setdefault(s, i)
+        if required is None:
+            required = file_filter.valid_suffixes
+        self.required = frozenset(required)
+        self.incomplete = incomplete
+
+    def groups(self, files):
+        """
+        Group file names (one directory). Returns `(complete, incomplete)`,
+        lists of groups (lists of names) sorted by common stem. Files without
+        valid suffix or extension are ignored.
+        """
+
+        buckets = {}
+        for file in files:
+            stem, _ = os.path.splitext(file)
+            s = self._filter.matchingSuffix(stem)
+            if s is None or not self._filter.validExtension(file):
+                continue
+            base = stem[: len(stem) - len(s)]
+            buckets.setdefault(base, []).append((self._order[s], file, s))
+        complete = []
+        incomplete = []
+        for base in sorted(buckets):
+            members = sorted(buckets[base])
+            group = [file for _, file, _ in members]
+            if self.required.issubset(s for _, _, s in members):
+                complete.append(group)
+            else:
+                incomplete.append(group)
+        return complete, incomplete
+
+
+def _hash_file(file, size=-1, block_size=1 << 20):
+    """blake2b digest of the first `size` bytes of `file` (whole file for -1)"""
+
+    h = hashlib.blake2b()
+    with open(file, "rb") as fh:
+        while size:
+            n = block_size if size < 0 else min(block_size, size)
+            data = fh.read(n)
+            if not data:
+                break
+            h.update(data)
+            if size > 0:
+                size -= len(data)
+    return h.digest()
+
+
+def _safe_hash(file, size):
+    try:
+        return _hash_file(file, size)
+    except OSError:
+        return None
+
+
+def _group_by_hash(pool, groups, size, batch=4096):
+    """
+    Split every group (list of files) into subgroups of equal hash of the
+    first `size` bytes, hashing in `pool` (in batches to bound the number of
+    pending futures). Returns the subgroups with more than one file.
+    """
+
+    tasks = [(i, file) for i, group in enumerate(groups) for file in group]
+    buckets = {}
+    for start in range(0, len(tasks), batch):
+        part = tasks[start : start + batch]
+        digests = pool.map(lambda task: _safe_hash(task[1], size), part)
+        for (i, file), digest in zip(part, digests):
+            if digest is not None:
+                buckets.setdefault((i, digest), []).append(file)
+    return [group for group in buckets.values() if len(group) > 1]
+
+
+def find_duplicates(
+    root, filter=None, *args, head_size=1 << 16, workers=8, print_progress=False
+):
+    """
+    Find files with identical content below `root`. Only files passing
+    `filter(file_name, *args)` are considered (see `filter_directory`).
+
+    Files are bucketed by size first. Within a size bucket, only the first
+    `head_size` bytes are hashed, and files are read completely only if their
+    heads collide as well. Hashing runs in a thread pool with `workers` threads.
+
+    Returns a list of groups (sorted lists of file names) of identical files.
+    """
+
+    by_size = {}
+    for file in iter_directory(root, filter, *args, print_progress=print_progress):
+        try:
+            size = os.path.getsize(file)
+        except OSError:
+            continue
+        by_size.setdefault(size, []).append(file)
+
+    ret = [files for size, files in by_size.items() if size == 0 and len(files) > 1]
+    small = [f for size, f in by_size.items() if 0 < size <= head_size and len(f) > 1]
+    large = [f for size, f in by_size.items() if size > head_size and len(f) > 1]
+    with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+        ret += _group_by_hash(pool, small, -1)
+        ret += _group_by_hash(pool, _group_by_hash(pool, large, head_size), -1)
+    return sorted(sorted(group) for group in ret)
@@ -0,0 +1,185 @@
+#
+import hashlib
+import json
+import os
+import os.path
+import sqlite3
+import time
+
+from mbeex.base.directory import CompiledFileFilter, scan_directory
+
+
+def default_cache_dir():
+    """Per user cache directory for index files (`~/.cache/mbeex`)"""
+
+    return os.path.join(os.path.expanduser("~"), ".cache", "mbeex")
+
+
+class SQLiteIndex:
+    """
+    Base of the persistent (SQLite) indices of a directory tree: opens the
+    database `<prefix>_<hash of the absolute root>.sqlite` in `cache_dir`
+    and creates the tables of the SQL script `schema` (if missing).
+    Closed by `close` or at the end of a `with` block.
+
+    Parameters:
+        :root:      directory tree
+        :cache_dir: directory for the index file (default: `default_cache_dir()`)
+        :prefix:    index file name prefix
+        :schema:    SQL script creating tables and indices
+    """
+
+    def __init__(self, root, cache_dir, prefix, schema):
+        self.root = os.fspath(root)
+        if cache_dir is None:
+            cache_dir = default_cache_dir()
+        os.makedirs(cache_dir, exist_ok=True)
+        key = hashlib.sha1(os.path.abspath(self.root).encode("utf-8")).hexdigest()
+        self.path = os.path.join(cache_dir, f"{prefix}_{key[:16]}.sqlite")
+        self._db = sqlite3.connect(self.path)
+        self._db.executescript(schema)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """Close the database connection"""
+
+        self._db.close()
+
+
+class DirectoryIndex(SQLiteIndex):
+    """
+    Persistent (SQLite) file listing of a directory tree for repeated
+    `filter_directory` queries.
+
+    Every directory is stored with its modification time. `update` stats
+    each known directory and lists (`os.scandir`) only those, whose
+    modification time changed (i.e. entries were added, removed or renamed),
+    so unchanged trees are validated without listing them. Queries are
+    answered from the index; a `CompiledFileFilter` with plain extensions
+    is narrowed down by the indexed extension column.
+
+    File contents are not tracked, only the listing.
+
+    Parameters:
+        :root:      directory tree
+        :cache_dir: directory for the index file (default: `default_cache_dir()`)
+    """
+
+    # directories modified less than this (seconds) before a scan are stored
+    # as outdated, because later changes may not alter the mtime (granularity)
+    RACY_WINDOW = 2.0
+
+    def __init__(self, root, cache_dir=None):
+        super().__init__(
+            root,
+            cache_dir,
+            "dirindex",
+            """
+            CREATE TABLE IF NOT EXISTS dirs (
+                path TEXT PRIMARY KEY, mtime_ns INTEGER, subdirs TEXT);
+            CREATE TABLE IF NOT EXISTS files (dir TEXT, name TEXT, ext TEXT);
+            CREATE INDEX IF NOT EXISTS files_dir ON files (dir);
+            CREATE INDEX IF NOT EXISTS files_ext ON files (ext);
+            """,
+        )
+
+    def update(self):
+        """
+        Bring the index up to date. Returns the number of (re)listed directories.
+        """
+
+        db = self._db
+        racy = time.time_ns() - int(DirectoryIndex.RACY_WINDOW * 1e9)
+        seen = set()
+        rescanned = 0
+        stack = [""]
+        with db:
+            while stack:
+                rel = stack.pop()
+                top = os.path.join(self.root, rel) if rel else self.root
+                try:
+                    mtime = os.stat(top).st_mtime_ns
+                except OSError:
+                    continue
+                row = db.execute(
+                    "SELECT mtime_ns, subdirs FROM dirs WHERE path = ?", (rel,)
+                ).fetchone()
+                if row is not None and row[0] == mtime:
+                    subdirs = json.loads(row[1])
+                else:
+                    try:
+                        dirs, files, links = scan_directory(top)
+                    except OSError:
+                        continue
+                    subdirs = [d for d in dirs if d not in links]
+                    db.execute("DELETE FROM files WHERE dir = ?", (rel,))
+                    db.executemany(
+                        "INSERT INTO files (dir, name, ext) VALUES (?, ?, ?)",
+                        [(rel, f, _extension(f)) for f in files],
+                    )
+                    db.execute(
+                        "INSERT OR REPLACE INTO dirs VALUES (?, ?, ?)",
+                        (rel, mtime if mtime < racy else -1, json.dumps(subdirs)),
+                    )
+                    rescanned += 1
+                seen.add(rel)
+                stack.extend(os.path.join(rel, d) for d in reversed(subdirs))
+
+            gone = [p for (p,) in db.execute("SELECT path FROM dirs") if p not in seen]
+            db.executemany("DELETE FROM dirs WHERE path = ?", [(p,) for p in gone])
+            db.executemany("DELETE FROM files WHERE dir = ?", [(p,) for p in gone])
+        return rescanned
+
+    def files(self, extensions=None):
+        """
+        Iterate over all indexed file names (sorted by directory and name),
+        optionally restricted to files whose last extension (lower case,
+        w/o dot) is contained in `extensions`.
+        """
+
+        sql = "SELECT dir, name FROM files"
+        params = ()
+        if extensions is not None:
+            params = tuple(extensions)
+            sql += f" WHERE ext IN ({', '.join('?' * len(params))})"
+        sql += " ORDER BY dir, name"
+        join = os.path.join
+        for rel, name in self._db.execute(sql, params):
+            yield join(self.root, rel, name)
+
+    def query(self, filter, *args, refresh=True):
+        """
+        Return the file names below `self.root` passing
+        `filter(file_name, *args) -> bool` (every file for `filter == None`).
+
+        Parameters:
+            :refresh: call `update` first; set to False to answer from
+                      the index only
+        """
+
+        if refresh:
+            self.update()
+        extensions = None
+        if isinstance(filter, CompiledFileFilter) and filter.valid_extensions:
+            if not [e for e in filter.valid_extensions if "." in e or os.sep in e]:
+                extensions = filter.valid_extensions
+        files = self.files(extensions)
+        if filter is None:
+            return list(files)
+        if isinstance(filter, CompiledFileFilter) and not args:
+            return filter.filterMany(files)
+        return [f for f in files if filter(f, *args)]
+
+
+def _extension(name):
+    """Lower case text after the last dot of `name` (None, if there is none)"""
+
+    pos = name.rfind(".")
+    if pos < 0:
+        return None
+    return name[pos + 1 :].lower()
@@ -0,0 +1,35 @@
+#
+import importlib
+import sys
+
+
+class LazyModule:
+    """
+    Module proxy importing module `name` on first attribute access. Heavy,
+    optional dependencies (matplotlib, torch, ...) are loaded only when a
+    function really uses them; a missing one raises `ModuleNotFoundError`
+    at this point instead of at import time.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<lazy module '{self._name}' ({state})>"
+
+
+def lazy_import(name):
+    """
+    Return module `name`, if already imported, otherwise a `LazyModule`:
+
+        plt = lazy_import("matplotlib.pyplot")
+    """
+
+    return sys.modules.get(name) or LazyModule(name)
@@ -0,0 +1,208 @@
+#
+import random
+import time
+
+
+def _percentile(sorted_values, q):
+    """`q` percentile (0..100) of an ascending list (nearest rank)"""
+
+    if not sorted_values:
+        return 0.0
+    i = int(round(q / 100 * (len(sorted_values) - 1)))
+    return sorted_values[i]
+
+
+class JobSummary:
+    """
+    Final metrics of a job (see `ProgressMeter.summary`).
+
+    Attributes:
+        :label:        job label
+        :files:        number of processed files
+        :bytes:        number of processed bytes (if measured)
+        :errors:       number of failed files
+        :elapsed:      wall clock time (s)
+        :files_per_s:  file throughput
+        :mb_per_s:     byte throughput (MB/s, 1 MB = 2**20 bytes)
+        :latency:      per-file latency percentiles (s) `{"p50", "p90", "p99", "max"}`
+    """
+
+    def __init__(self, label, files, nbytes, errors, elapsed, latencies):
+        self.label = label
+        self.files = files
+        self.bytes = nbytes
+        self.errors = errors
+        self.elapsed = elapsed
+        self.files_per_s = files / elapsed if elapsed > 0 else 0.0
+        self.mb_per_s = nbytes / 2**20 / elapsed if elapsed > 0 else 0.0
+        latencies = sorted(latencies)
+        self.latency = {
+            "p50": _percentile(latencies, 50),
+            "p90": _percentile(latencies, 90),
+            "p99": _percentile(latencies, 99),
+            "max": latencies[-1] if latencies else 0.0,
+        }
+
+    def asDict(self):
+        """Flat dictionary (e.g. for export to monitoring systems)"""
+
+        ret = {
+            "label": self.label,
+            "files": self.files,
+            "bytes": self.bytes,
+            "errors": self.errors,
+            "elapsed_s": self.elapsed,
+            "files_per_s": self.files_per_s,
+            "mb_per_s": self.mb_per_s,
+        }
+        for k, v in self.latency.items():
+            ret[f"latency_{k}_s"] = v
+        return ret
+
+    def __str__(self):
+        return (
+            f"{self.label}: {self.files} files ({self.errors} errors) "
+            f"in {self.elapsed:.1f}s, {self.files_per_s:.1f} files/s, "
+            f"{self.mb_per_s:.1f} MB/s, latency p50/p99: "
+            f"{self.latency['p50'] * 1000:.1f}/{self.latency['p99'] * 1000:.1f}ms"
+        )
+
+
+class ProgressMeter:
+    """
+    Throughput meter and time throttled progress output for directory jobs.
+
+    `update` is cheap and can be called per file; the progress line is
+    rendered at most every `interval` seconds. Per-file latencies are kept
+    in a fixed size random sample (reservoir), so memory does not grow
+    with the number of files.
+
+    Subclass and override `report` (called throttled) or pass `callback`
+    (`callback(meter)`) to feed other outputs than the console.
+
+    Parameters:
+        :label:         text in front of the progress line
+        :interval:      minimum time (s) between two progress outputs
+        :output:        print the progress line to stdout
+        :callback:      optional function, called throttled with the meter
+        :measure_bytes: let walkers determine the size of processed files
+        :samples:       maximum number of stored latency samples
+    """
+
+    def __init__(
+        self,
+        label="Progress",
+        interval=0.5,
+        output=True,
+        callback=None,
+        measure_bytes=True,
+        samples=10000,
+    ):
+        self.label = label
+        self.interval = interval
+        self.output = output
+        self.callback = callback
+        self.measure_bytes = measure_bytes
+        self._samples = samples
+        self.start()
+
+    def start(self):
+        """Reset all counters and the clock"""
+
+        self.files = 0
+        self.bytes = 0
+        self.errors = 0
+        self.total = None
+        self.approx = False
+        self._latencies = []
+        self._latency_count = 0
+        self._t0 = time.monotonic()
+        self._last = None
+
+    def elapsed(self):
+        return time.monotonic() - self._t0
+
+    def setTotal(self, total, approx=False):
+        """Set (estimated) total number of files"""
+
+        self.total = total
+        self.approx = approx
+
+    def update(self, files=1, nbytes=0, latency=None, errors=0):
+        """
+        Account `files` processed files with `nbytes` bytes and optional
+        per-file `latency` (s); outputs progress, if `interval` has passed.
+        """
+
+        self.files += files
+        self.bytes += nbytes
+        self.errors += errors
+        if latency is not None:
+            self._latency_count += 1
+            if len(self._latencies) < self._samples:
+                self._latencies.append(latency)
+            else:
+                i = random.randrange(self._latency_count)
+                if i < self._samples:
+                    self._latencies[i] = latency
+        now = time.monotonic()
+        if self._last is None or now - self._last >= self.interval:
+            self._last = now
+            self.report()
+
+    def eta(self):
+        """Estimated remaining time (s) or None"""
+
+        if not self.total or not self.files:
+            return None
+        remaining = max(self.total - self.files, 0)
+        return remaining * self.elapsed() / self.files
+
+    def line(self):
+        """Progress line text"""
+
+        elapsed = self.elapsed()
+        fps = self.files / elapsed if elapsed > 0 else 0.0
+        text = f"{self.label}: "
+        if self.total is not None:
+            total = max(self.total, self.files)
+            approx = "~" if self.approx else ""
+            percent = (100 * self.files) // total if total else 100
+            text += f"{approx}{percent}% ({self.files}/{approx}{total} files"
+        else:
+            text += f"({self.files} files"
+        text += f", {fps:.1f} files/s"
+        if self.bytes and elapsed > 0:
+            text += f", {self.bytes / 2**20 / elapsed:.1f} MB/s"
+        eta = self.eta()
+        if eta is not None:
+            text += f", ETA {int(eta) // 60}:{int(eta) % 60:02d}"
+        return text + ")"
+
+    def report(self):
+        """Throttled progress output"""
+
+        if self.output:
+            print(self.line(), end="\r")
+        if self.callback is not None:
+            self.callback(self)
+
+    def summary(self):
+        """Return `JobSummary` of the metrics collected so far"""
+
+        return JobSummary(
+            self.label,
+            self.files,
+            self.bytes,
+            self.errors,
+            self.elapsed(),
+            self._latencies,
+        )
+
+    def finish(self):
+        """Final (unthrottled) output; returns `summary()`"""
+
+        self.report()
+        if self.output:
+            print("")
+        return self.summary()
@@ -1,8 +1,16 @@
+import collections
+import concurrent.futures
+import functools
+import math
 import os
+import threading
 import numpy as np
 import cv2
-import matplotlib.pyplot as plt
-import matplotlib.colors as mcol
+from mbeex.base.cache import DefaultCache, LRUCache
+from mbeex.base.lazy import lazy_import
+
+plt = lazy_import("matplotlib.pyplot")
+mcol = lazy_import("matplotlib.colors")
 
 
 class ImageException(Exception):
@@ -29,24 +37,93 @@ def image_area(img):
     return img.shape[0] * img.shape[1]
 
 
-def create_mono_colored_image(size, depth, color):
+class ImageBufferPool:
+    """
+    Small pool of temporary image buffers, keyed by shape and type, for
+    intermediate results of functions called in loops (e.g. masks of the
+    overlay functions). Buffers taken with `get` are exclusively owned
+    until they are returned with `put`; buffer contents are undefined.
+    Thread safe.
+
+    Parameters:
+        :max_keys:     maximum number of different shape/type keys (least
+                       recently used keys are dropped)
+        :max_per_key:  maximum number of kept buffers per key
+    """
+
+    def __init__(self, max_keys=16, max_per_key=4):
+        self.max_keys = max_keys
+        self.max_per_key = max_per_key
+        self._buffers = collections.OrderedDict()  # (shape, dtype) -> [array]
+        self._lock = threading.Lock()
+
+    def get(self, shape, dtype=np.uint8):
+        """Return a buffer of `shape` and `dtype` (pooled or new)"""
+
+        key = (tuple(shape), np.dtype(dtype))
+        with self._lock:
+            buffers = self._buffers.get(key)
+            if buffers:
+                self._buffers.move_to_end(key)
+                return buffers.pop()
+        return np.empty(key[0], key[1])
+
+    def put(self, buffer):
+        """Return `buffer` to the pool"""
+
+        key = (buffer.shape, buffer.dtype)
+        with self._lock:
+            buffers = self._buffers.setdefault(key, [])
+            self._buffers.move_to_end(key)
+            if len(buffers) < self.max_per_key:
+                buffers.append(buffer)
+            while len(self._buffers) > self.max_keys:
+                self._buffers.popitem(last=False)
+
+
+_buffer_pool = ImageBufferPool()
+_rng = np.random.default_rng()
+
+
+def _check_out(out, shape, dtype=np.uint8):
+    if out.shape != tuple(shape) or out.dtype != dtype:
+        raise ImageException(f"output buffer mismatch: {out.shape} {out.dtype}")
+
+
+def create_mono_colored_image(size, depth, color, out=None):
     """
     Return new mono-colored (`depth==3`) [with alpha for `depth==4`]
-    or grayscale (`depth == 1`) image
+    or grayscale (`depth == 1`) image. With `out` (uint8 array of shape
+    `(size[0], size[1], depth)`), this buffer is filled and returned.
     """
 
-    img = np.empty((size[0], size[1], depth), np.uint8)
-    img[:] = color
-    return img
+    shape = (size[0], size[1], depth)
+    if out is None:
+        out = np.empty(shape, np.uint8)
+    else:
+        _check_out(out, shape)
+    out[:] = color
+    return out
 
 
-def create_noisy_image(size, depth):
+def create_noisy_image(size, depth, out=None, rng=None):
     """
     Return image with every pixel channel randomized
+
+    Parameters:
+        :out: optional uint8 output array of shape `(size[0], size[1], depth)`
+        :rng: `numpy.random.Generator` (default: module wide generator)
     """
 
-    imarray = np.random.randint(0, 256, size=(size[0], size[1], depth)).astype("uint8")
-    return imarray
+    shape = (size[0], size[1], depth)
+    if rng is None:
+        rng = _rng
+    noise = rng.integers(0, 256, size=shape, dtype=np.uint8)
+    if out is None:
+        return noise
+    _check_out(out, shape)
+    np.copyto(out, noise)
+    return out
 
 
 def transformation_from_angle(img, angle):
@@ -63,8 +140,12 @@ def transformation_from_angle(img, angle):
         :return:    `[transformation matrix for OpenCV warpAffine, width, height]`
     """
 
-    w = img.shape[1]
-    h = img.shape[0]
+    return _rotation(img.shape[0], img.shape[1], angle)
+
+
+def _rotation(h, w, angle):
+    """`transformation_from_angle` for an image of height `h` and width `w`"""
+
     # now calculate new image width and height
     nw = abs(np.sin(angle) * h) + abs(np.cos(angle) * w)
     nh = abs(np.cos(angle) * h) + abs(np.sin(angle) * w)
@@ -77,10 +158,120 @@ def transformation_from_angle(img, angle):
     # part of the transform
     rot_mat[0, 2] += rot_move[0]
     rot_mat[1, 2] += rot_move[1]
-    return [rot_mat, int(np.math.ceil(nw)), int(np.math.ceil(nh))]
+    return [rot_mat, int(math.ceil(nw)), int(math.ceil(nh))]
+
 
+class TransformCache(LRUCache):
+    """
+    Thread-safe LRU cache of rotation transforms, rectangle masks and
+    bounding box warp maps (see `_box_maps`) for `rotated_rect_mask`
+    (see `mbeex.base.cache.LRUCache`). Least recently used entries are
+    evicted, when the summed size of the cached masks and maps exceeds
+    `max_bytes` (larger entries are not cached at all). Cached arrays are
+    shared and read-only.
 
-def create_transformed_rect_mask(src_size, trafo, dst_size, flags):
+    Parameters:
+        :max_bytes: memory budget
+    """
+
+    def __init__(self, max_bytes=64 * 2**20):
+        super().__init__(max_bytes)
+
+    def size(self, entry):
+        _, _, mask, maps = entry
+        return mask.nbytes + (0 if maps is None else maps[1].nbytes)
+
+    def put(self, key, entry):
+        """
+        Insert `(trafo, dst_size, mask, maps)` (`maps`: None or `(box,
+        int16 maps)`); the arrays are made read-only
+        """
+
+        trafo, _, mask, maps = entry
+        trafo.flags.writeable = False
+        mask.flags.writeable = False
+        if maps is not None:
+            maps[1].flags.writeable = False
+        super().put(key, entry)
+
+
+_transform_cache = DefaultCache(TransformCache())
+
+
+def set_transform_cache(cache):
+    """
+    Set the default `TransformCache` of `rotated_rect_mask` (None disables
+    caching). Returns the previous cache.
+    """
+
+    return _transform_cache.set(cache)
+
+
+def get_transform_cache():
+    """Return the default `TransformCache` of `rotated_rect_mask` (or None)"""
+
+    return _transform_cache.cache
+
+
+def rotated_rect_mask(
+    src_size, angle, dx0=0, dy0=0, dx1=0, dy1=0, flags=cv2.INTER_NEAREST, cache=None
+):
+    """
+    Transformation and mask for putting an image of size `src_size`,
+    rotated by `angle` (radians) around its center, on a background
+    enlarged by the offsets (see `overlay_on_noisy_background`).
+    Results are memoized in a `TransformCache`, so repeated angles, sizes
+    and offsets cost no `warpAffine` call.
+
+    Parameters:
+        :cache:  `TransformCache` to use, False to bypass caching or None
+                 for the default cache (see `set_transform_cache`)
+        :return: `(trafo, dst_size, mask)`: transformation for
+                 `cv2.warpAffine` (see `transformation_from_angle`),
+                 background size `[height, width]` and the transformed
+                 rectangular mask; cached arrays are read-only
+    """
+
+    return _rotated_geometry(src_size, angle, dx0, dy0, dx1, dy1, flags, cache)[:3]
+
+
+def _rotated_geometry(src_size, angle, dx0, dy0, dx1, dy1, flags, cache):
+    """
+    `rotated_rect_mask` result plus the bounding box warp `(box, maps)`
+    (see `_box_maps`), if the rotated image covers a small part of the
+    background only (otherwise None: the full background is warped)
+    """
+
+    if cache is None:
+        cache = _transform_cache.cache
+    key = (src_size[0], src_size[1], angle, dx0, dy0, dx1, dy1, flags)
+    if cache:
+        entry = cache.get(key)
+        if entry is not None:
+            return entry
+    trafo, w, h = _rotation(src_size[0], src_size[1], angle)
+    # adjust matrix translation part
+    trafo[0, 2] += dx0
+    trafo[1, 2] += dy0
+    dst_size = (h + dy0 + dy1, w + dx0 + dx1)
+    maps = None
+    box = _box(src_size, trafo, flags, dst_size, cost=_CACHED_BOX_COST)
+    if box is not None and box[2] > box[0] and box[3] > box[1]:
+        maps = (box, _box_maps(src_size, trafo, flags, box))
+        x0, y0, x1, y1 = box
+        mask = np.zeros(dst_size, np.uint8)
+        rect = _rect_mask(src_size, maps[1])
+        mask[y0:y1, x0:x1] = rect
+        _buffer_pool.put(rect)
+    else:
+        mask = create_transformed_rect_mask(src_size, trafo, dst_size, flags)
+    entry = (trafo, dst_size, mask, maps)
+    if cache:
+        cache.put(key, entry)
+    return entry
+
+
+def create_transformed_rect_mask(src_size, trafo, dst_size, flags, out=None):
     """
     Create white grayscale image, transform it into black target and return result image
 
@@ -89,17 +280,201 @@ def create_transformed_rect_mask(src_size, trafo, dst_size, flags):
         :trafo:     affine transformation for cv2.warpAffine
         :dst_size:  target size (pre-calculated)
         :flags:     cv2.warpAffine flags
+        :out:       optional uint8 output array of shape `dst_size[:2]`
         :return:    transformed rectangular mask (white==255) on black background
     """
-    img = create_mono_colored_image(src_size, 1, 255)
-    img = cv2.warpAffine(img, trafo, (dst_size[1], dst_size[0]), flags=flags)
-    _, mask = cv2.threshold(
-        img, 0, 255, cv2.THRESH_BINARY
-    )  # set all pixels > 0 to white (255)
+    if out is not None:
+        _check_out(out, dst_size[:2])
+    box = _box(src_size, trafo, flags, dst_size)
+    if box is None:
+        img = create_mono_colored_image(
+            src_size, 1, 255, out=_buffer_pool.get((src_size[0], src_size[1], 1))
+        )
+        out = cv2.warpAffine(
+            img, trafo, (dst_size[1], dst_size[0]), dst=out, flags=flags
+        )
+        _buffer_pool.put(img)
+        _, out = cv2.threshold(
+            out, 0, 255, cv2.THRESH_BINARY, dst=out
+        )  # set all pixels > 0 to white (255)
+        return out
+    if out is None:
+        out = np.zeros(dst_size[:2], np.uint8)
+    else:
+        out[...] = 0
+    x0, y0, x1, y1 = box
+    if x1 > x0 and y1 > y0:
+        maps = _box_maps(src_size, trafo, flags, box)
+        mask = _rect_mask(src_size, maps)
+        out[y0:y1, x0:x1] = mask
+        _buffer_pool.put(mask)
+        _buffer_pool.put(maps)
+    return out
+
+
+def _box_warp_supported(flags, dtype, channels=1):
+    """
+    True, if `cv2.warpAffine` with `flags` of images of `dtype` and
+    `channels` can be restricted to the bounding box of the transformed
+    image (see `_box_maps`); other interpolations and image types warp the
+    full canvas.
+    """
+
+    return flags & ~cv2.WARP_INVERSE_MAP == cv2.INTER_NEAREST and _exact_box_warp(
+        np.dtype(dtype), channels
+    )
+
+
+# cost of warping a bounding box pixel relative to warping a full canvas
+# pixel (`cv2.warpAffine`): with `_box_maps` computed per call and cached
+_BOX_COST = 4
+_CACHED_BOX_COST = 2
+
+
+def _box(src_size, trafo, flags, dst_size, dtype=np.uint8, channels=1, cost=_BOX_COST):
+    """
+    Bounding box `(x0, y0, x1, y1)` (see `_warp_box`) to restrict a warp of
+    an image of `dtype` and `channels` and of its rectangle mask to, or
+    None, if the full `dst_size` canvas is to be warped: the box warp is
+    not exact for the image type, or it is not cheaper for boxes covering
+    more than `1 / cost` of the canvas.
+    """
+
+    if not _box_warp_supported(flags, dtype, channels) or not _box_warp_supported(
+        flags, np.uint8
+    ):
+        return None
+    x0, y0, x1, y1 = _warp_box(src_size, trafo, flags, dst_size)
+    if (x1 - x0) * (y1 - y0) * cost >= dst_size[0] * dst_size[1]:
+        return None
+    return x0, y0, x1, y1
+
+
+def _warp_box(src_size, trafo, flags, dst_size):
+    """
+    Bounding box `(x0, y0, x1, y1)` of the `src_size` rectangle transformed
+    by `trafo` (a destination to source map with `cv2.WARP_INVERSE_MAP` in
+    `flags`), with a margin, clipped to `dst_size`. Everything outside is
+    untouched by the transformed image.
+    """
+
+    if flags & cv2.WARP_INVERSE_MAP:
+        trafo = cv2.invertAffineTransform(np.asarray(trafo, np.float64))
+    h, w = src_size[0], src_size[1]
+    corners = np.array([[-4, -4, 1], [w + 3, -4, 1], [-4, h + 3, 1], [w + 3, h + 3, 1]])
+    corners = corners @ np.asarray(trafo, np.float64).T
+    x0 = max(math.floor(corners[:, 0].min()) - 1, 0)
+    y0 = max(math.floor(corners[:, 1].min()) - 1, 0)
+    x1 = min(math.ceil(corners[:, 0].max()) + 2, dst_size[1])
+    y1 = min(math.ceil(corners[:, 1].max()) + 2, dst_size[0])
+    return x0, y0, max(x1, x0), max(y1, y0)
+
+
+def _box_maps(src_size, trafo, flags, box):
+    """
+    Pooled `cv2.remap` map (int16 `(x, y)` pairs) of the destination pixels
+    in `box` (caller returns it to the pool). The source pixels are selected
+    like `cv2.warpAffine` with `cv2.INTER_NEAREST` does on the full canvas:
+    the inverse transformation in float32, the row term `m1 * y + m2`
+    rounded to float32, `m0 * x` added with a single rounding, and rounded
+    to the nearest pixel (`cv2.convertMaps`, saturating far outside pixels).
+    """
+
+    if not flags & cv2.WARP_INVERSE_MAP:
+        trafo = cv2.invertAffineTransform(np.asarray(trafo, np.float64))
+    trafo = np.asarray(trafo, np.float32)
+    x0, y0, x1, y1 = box
+    size = (y1 - y0, x1 - x0)
+    xs = np.arange(x0, x1, dtype=np.float64)
+    ys = np.arange(y0, y1, dtype=np.float32)
+    exact = _buffer_pool.get(size, np.float64)
+    rows = _buffer_pool.get(size, np.float64)
+    coords = [_buffer_pool.get(size, np.float32) for _ in range(2)]
+    for i in range(2):
+        # broadcasting assignments, unlike broadcasting ufuncs, need no buffers
+        exact[...] = xs * np.float64(trafo[i, 0])
+        rows[...] = (ys * trafo[i, 1] + trafo[i, 2]).astype(np.float64)[:, None]
+        np.add(exact, rows, out=exact)
+        np.copyto(coords[i], exact, casting="same_kind")
+    maps, _ = cv2.convertMaps(
+        coords[0],
+        coords[1],
+        cv2.CV_16SC2,
+        dstmap1=_buffer_pool.get(size + (2,), np.int16),
+        nninterpolation=True,
+    )
+    for buffer in coords + [rows, exact]:
+        _buffer_pool.put(buffer)
+    return maps
+
+
+def _box_warp(img, maps):
+    """Pooled image of `img` remapped by `_box_maps` (caller returns it to the pool)"""
+
+    warped = _buffer_pool.get(maps.shape[:2] + img.shape[2:], img.dtype)
+    return cv2.remap(
+        img,
+        maps,
+        None,
+        cv2.INTER_NEAREST,
+        dst=warped,
+        borderMode=cv2.BORDER_CONSTANT,
+        borderValue=0,
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def _exact_box_warp(dtype, channels):
+    """
+    True, if `_box_maps` selects the same pixels as this OpenCV version's
+    `cv2.warpAffine` for images of `dtype` and `channels` (checked once on a
+    few transformations of random images). OpenCV selects pixels
+    differently depending on the image type, e.g. for two channels or
+    float64; such images are warped on the full canvas.
+    """
+
+    rng = np.random.default_rng(0)
+    src = rng.integers(1, 250, (37, 53, channels)).astype(dtype)
+    for angle, scale, flags in [
+        (0, 1, cv2.INTER_NEAREST),
+        (90, 1, cv2.INTER_NEAREST),
+        (33.3, 1.7, cv2.INTER_NEAREST),
+        (-151.2, 0.6, cv2.INTER_NEAREST),
+        (12.1, 4.3, cv2.INTER_NEAREST),
+        (45, 2.5, cv2.INTER_NEAREST | cv2.WARP_INVERSE_MAP),
+        (-77.7, 0.35, cv2.INTER_NEAREST | cv2.WARP_INVERSE_MAP),
+    ]:
+        trafo = cv2.getRotationMatrix2D((26.5, 18.25), angle, scale)
+        trafo[:, 2] += (90.3, 70.6)
+        expected = cv2.warpAffine(src, trafo, (240, 180), flags=flags)
+        expected = expected.reshape(expected.shape[:2] + (channels,))
+        x0, y0, x1, y1 = _warp_box(src.shape, trafo, flags, expected.shape)
+        result = np.zeros_like(expected)
+        if x1 > x0 and y1 > y0:
+            maps = _box_maps(src.shape, trafo, flags, (x0, y0, x1, y1))
+            warped = _box_warp(src, maps)
+            result[y0:y1, x0:x1] = warped.reshape(warped.shape[:2] + (channels,))
+            _buffer_pool.put(warped)
+            _buffer_pool.put(maps)
+        if not (result == expected).all():
+            return False
+    return True
+
+
+def _rect_mask(src_size, maps):
+    """Pooled white rectangle of `src_size` remapped by `_box_maps` (caller returns it)"""
+
+    img = create_mono_colored_image(
+        src_size, 1, 255, out=_buffer_pool.get((src_size[0], src_size[1], 1))
+    )
+    mask = _box_warp(img[..., 0], maps)
+    _buffer_pool.put(img)
     return mask
 
 
-def overlay_on_noisy_background(img, angle, dx0=0, dy0=0, dx1=0, dy1=0):
+def overlay_on_noisy_background(
+    img, angle, dx0=0, dy0=0, dx1=0, dy1=0, out=None, rng=None
+):
     """
     Put transformed image on white-noise background.
     Offsets must be always >= 0.
@@ -111,28 +486,160 @@ def overlay_on_noisy_background(img, angle, dx0=0, dy0=0, dx1=0, dy1=0):
         :dy0:   y offset (top)
         :dx1:   x offset (right)
         :dy1:   y offset (bottom)
+        :out:   optional output array (shape of the result)
+        :rng:   `numpy.random.Generator` for the noise (see `create_noisy_image`)
     """
 
-    par = transformation_from_angle(img, angle)
+    trafo, dst_size, mask, maps = _rotated_geometry(
+        image_size(img), angle, dx0, dy0, dx1, dy1, cv2.INTER_NEAREST, None
+    )
+    bg = create_noisy_image(dst_size, img.shape[2], out=out, rng=rng)
+    return _composite(img, bg, trafo, cv2.INTER_NEAREST, mask, maps)
 
-    # adjust matrix translation part
-    par[0][0, 2] += dx0
-    par[0][1, 2] += dy0
-    par[1] += dx0 + dx1
-    par[2] += dy0 + dy1
 
-    bg = create_noisy_image([par[2], par[1]], img.shape[2])
-    return overlay_transformed_image(img, bg, par[0])
+def _broadcast(values, n, name):
+    if len(values) == 1:
+        return values * n
+    if len(values) != n:
+        raise ImageException(f"{len(values)} {name} for a batch of {n}")
+    return values
+
+
+def overlay_batch_on_noisy_background(
+    imgs, angles, offsets=None, seed=None, workers=4, out=None
+):
+    """
+    Batched `overlay_on_noisy_background`: N images, or one image with N
+    angles and offsets, are put on noise backgrounds of one common size
+    and returned as stacked `(N, H, W, C)` array. Samples with equal
+    geometry share transformation and mask, the samples are processed by
+    a thread pool writing directly into the batch array.
+
+    The common size is the maximum result size of all samples; smaller
+    samples get larger right/bottom offsets. Sample `i` equals
+    `overlay_on_noisy_background` with these enlarged offsets and
+    `rng=np.random.default_rng(seeds[i])`, so it can be recreated alone.
+
+    Parameters:
+        :imgs:    list of N images with equal depth or a single image
+        :angles:  list of N rotation angles (radians) or a single angle
+        :offsets: None, one or N tuples `(dx0, dy0, dx1, dy1)`
+        :seed:    seed of the batch (None: random), see `numpy.random.SeedSequence`
+        :workers: number of threads
+        :out:     optional uint8 output array `(N, H, W, C)`
+        :return:  `(batch, seeds)`: batch array and list of N sample seeds
+    """
+
+    imgs = [imgs] if isinstance(imgs, np.ndarray) else list(imgs)
+    angles = list(angles) if np.ndim(angles) else [angles]
+    offsets = [(0, 0, 0, 0)] if offsets is None else list(offsets)
+    if offsets and np.ndim(offsets[0]) == 0:
+        offsets = [tuple(offsets)]
+    n = max(len(imgs), len(angles), len(offsets))
+    imgs = _broadcast(imgs, n, "images")
+    angles = _broadcast(angles, n, "angles")
+    offsets = _broadcast(offsets, n, "offsets")
+    depth = imgs[0].shape[2]
+
+    # common size: maximum rotated hull plus offsets
+    sizes = []
+    for img, angle, (dx0, dy0, dx1, dy1) in zip(imgs, angles, offsets):
+        _, w, h = _rotation(img.shape[0], img.shape[1], angle)
+        sizes.append((h + dy0 + dy1, w + dx0 + dx1))
+    height = max(s[0] for s in sizes)
+    width = max(s[1] for s in sizes)
+    shape = (n, height, width, depth)
+    if out is None:
+        out = np.empty(shape, np.uint8)
+    else:
+        _check_out(out, shape)
+
+    geometry = {}  # shared transformations and masks
+    tasks = []
+    for img, angle, (dx0, dy0, dx1, dy1), (h, w) in zip(imgs, angles, offsets, sizes):
+        key = (img.shape[:2], angle, dx0, dy0, dx1 + width - w, dy1 + height - h)
+        if key not in geometry:
+            geometry[key] = _rotated_geometry(key[0], *key[1:], cv2.INTER_NEAREST, None)
+        tasks.append((img, geometry[key]))
+    seeds = [int(s) for s in np.random.SeedSequence(seed).generate_state(n, np.uint64)]
+
+    def overlay(i):
+        img, (trafo, dst_size, mask, maps) = tasks[i]
+        bg = create_noisy_image(
+            dst_size, depth, out=out[i], rng=np.random.default_rng(seeds[i])
+        )
+        _composite(img, bg, trafo, cv2.INTER_NEAREST, mask, maps)
+
+    with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+        list(pool.map(overlay, range(n)))
+    return out, seeds
 
 
 def overlay_transformed_image(top, bg, trafo):
-    flag = cv2.INTER_NEAREST
-    mask = create_transformed_rect_mask(
-        image_size(top), trafo, image_size(bg), flags=flag
-    )
-    bgs = image_size(bg)
-    top = cv2.warpAffine(top, trafo, (bgs[1], bgs[0]), flags=flag)
-    return overlay_images(top, bg, mask)
+    """
+    Transform `top` by `trafo` and copy it onto `bg` (in place, `bg` is
+    returned). If the transformed image covers a small part of `bg` only,
+    just its bounding box is warped and composited, so the cost depends on
+    the size of `top`, not on the size of `bg`. Temporary images are taken
+    from a buffer pool.
+    """
+
+    return _composite(top, bg, trafo, cv2.INTER_NEAREST)
+
+
+def _composite(top, bg, trafo, flags, mask=None, maps=None):
+    """
+    Warp `top` and copy it onto `bg` (in place), where `mask` (full `bg`
+    size) is set; without `mask`, the transformed rectangle of `top` is
+    used. Small transformed images are warped into their bounding box only
+    (see `_box`, `maps`: cached `(box, maps)` of `_box_maps`), with results
+    identical to warping on the full `bg` canvas. Returns `bg`.
+    """
+
+    size = image_size(bg)
+    channels = top.shape[2] if top.ndim > 2 else 1
+    if maps is not None and _box_warp_supported(flags, top.dtype, channels):
+        box, maps = maps
+    else:
+        box = _box(image_size(top), trafo, flags, size, top.dtype, channels)
+        maps = None
+    if box is None:
+        warped = _buffer_pool.get(size + top.shape[2:], top.dtype)
+        warped = cv2.warpAffine(top, trafo, (size[1], size[0]), dst=warped, flags=flags)
+        if mask is None:
+            own = _buffer_pool.get(size)
+            mask = create_transformed_rect_mask(
+                image_size(top), trafo, size, flags, own
+            )
+            _copy_masked(bg, warped, mask)
+            _buffer_pool.put(own)
+        else:
+            _copy_masked(bg, warped, mask)
+        _buffer_pool.put(warped)
+        return bg
+    x0, y0, x1, y1 = box
+    if x1 <= x0 or y1 <= y0:
+        return bg
+    own_maps = maps is None
+    if own_maps:
+        maps = _box_maps(image_size(top), trafo, flags, box)
+    warped = _box_warp(top, maps)
+    if mask is None:
+        mask = _rect_mask(image_size(top), maps)
+        _copy_masked(bg[y0:y1, x0:x1], warped, mask)
+        _buffer_pool.put(mask)
+    else:
+        _copy_masked(bg[y0:y1, x0:x1], warped, mask[y0:y1, x0:x1])
+    _buffer_pool.put(warped)
+    if own_maps:
+        _buffer_pool.put(maps)
+    return bg
+
+
+def _copy_masked(view, img, mask):
+    """Copy `img` onto `view` (in place, also strided views) where `mask` is set"""
+
+    cv2.copyTo(img.reshape(view.shape), mask, view)
 
 
 def overlay_images(top, bg, mask):
@@ -152,10 +659,9 @@ def overlay_images(top, bg, mask):
     return cv2.copyTo(top, mask, bg)
 
 
-def colormapped_image(img, matplot_map_name):
-    """
-    Applies matplotlib colormap to opencv grayscale image
-    """
+@functools.lru_cache(maxsize=None)
+def _colormap(matplot_map_name):
+    """matplotlib colormap `matplot_map_name` with black as 1st entry"""
 
     cmap = plt.get_cmap(matplot_map_name)
     cmaplist = [cmap(i) for i in range(cmap.N)]
@@ -168,11 +674,60 @@ def colormapped_image(img, matplot_map_name):
         1.0,
     )  # clip this later, if using 1.0 values for color components
     # colormap = mcol.LinearSegmentedColormap.from_list("mbeex", cmaplist, cmap.N)
-    colormap = mcol.ListedColormap(cmaplist, "mbeex", cmap.N)
-    cmap = colormap(img) * 2**16
+    return mcol.ListedColormap(cmaplist, "mbeex", cmap.N)
+
+
+def _colormap_rgba(colormap, values, dtype):
+    """RGBA colors of `values` (uint8: matplotlib bytes, uint16: values * 2**16)"""
+
+    if dtype == np.uint8:
+        return colormap(values, bytes=True)
+    cmap = colormap(values) * 2**16
     # np.clip(cmap, 0, 2 ** 16 - 1, out=cmap)  # avoid overflows (see above)
-    result = cmap.astype(np.uint16)[:, :, :3]
-    return cv2.cvtColor(result, cv2.COLOR_RGB2BGR)
+    return cmap.astype(np.uint16)
+
+
+@functools.lru_cache(maxsize=32)
+def _colormap_lut(matplot_map_name, dtype, size):
+    """
+    Read only BGR lookup table `(size, 3)` of colormap `matplot_map_name`
+    for integer images with `size` possible values (256 or 65536)
+    """
+
+    colormap = _colormap(matplot_map_name)
+    n = colormap.N
+    lut = _colormap_rgba(colormap, np.arange(n), dtype)[:, 2::-1]  # RGB -> BGR
+    # like the colormap, map values >= N to the last entry ("over" color)
+    lut = np.ascontiguousarray(lut[np.minimum(np.arange(size), n - 1)])
+    lut.flags.writeable = False
+    return lut
+
+
+def colormapped_image(img, matplot_map_name, dtype=np.uint16, out=None):
+    """
+    Applies matplotlib colormap to opencv grayscale image
+
+    The colors of uint8 and uint16 images are looked up in BGR tables,
+    which are computed once per colormap; other image types are mapped
+    by matplotlib directly.
+
+    Parameters:
+        :dtype: output type, `np.uint16` (full range colors) or `np.uint8`
+        :out:   optional output array (shape `img.shape + (3,)`, type `dtype`)
+    """
+
+    dtype = np.dtype(dtype)
+    if dtype not in (np.uint8, np.uint16):
+        raise ImageException(f"unsupported colormap output type: {dtype}")
+    if img.dtype in (np.uint8, np.uint16):
+        lut = _colormap_lut(matplot_map_name, dtype, 1 << (8 * img.dtype.itemsize))
+        return np.take(lut, img, axis=0, out=out, mode="clip")
+    rgba = _colormap_rgba(_colormap(matplot_map_name), img, dtype)
+    result = cv2.cvtColor(np.ascontiguousarray(rgba[..., :3]), cv2.COLOR_RGB2BGR)
+    if out is None:
+        return result
+    np.copyto(out, result)
+    return out
 
 
 def find_contours(img, threshold, complexity=cv2.RETR_TREE):
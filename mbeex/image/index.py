@@ -0,0 +1,116 @@
+#
+import concurrent.futures
+import os
+import os.path
+
+from mbeex.base.directory import FileFilter, walk_directory
+from mbeex.base.index import SQLiteIndex
+from mbeex.image.io import ImageInfo, probe_image
+
+IMAGE_EXTENSIONS = ["png", "jpg", "jpeg", "jpe", "tif", "tiff"]
+
+
+class ImageIndex(SQLiteIndex):
+    """
+    Persistent (SQLite) index of the header properties (`ImageInfo`) of all
+    PNG, JPEG and TIFF files of a directory tree.
+
+    `update` walks the tree and probes the headers (`probe_image`, thread pool)
+    of new or changed files only (modification time or size differ).
+    `query` selects images by SQL conditions on the columns
+    `path` (relative), `format`, `width`, `height`, `channels` and `depth`:
+
+        index.query("channels = 4 AND max(width, height) > 4096")
+
+    Parameters:
+        :root:       directory tree
+        :cache_dir:  directory for the index file (default: `default_cache_dir()`)
+        :extensions: extensions of indexed files
+    """
+
+    def __init__(self, root, cache_dir=None, extensions=IMAGE_EXTENSIONS):
+        super().__init__(
+            root,
+            cache_dir,
+            "imageindex",
+            """
+            CREATE TABLE IF NOT EXISTS images (
+                path TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER,
+                format TEXT, width INTEGER, height INTEGER,
+                channels INTEGER, depth INTEGER);
+            CREATE INDEX IF NOT EXISTS images_channels ON images (channels);
+            CREATE INDEX IF NOT EXISTS images_width ON images (width);
+            CREATE INDEX IF NOT EXISTS images_height ON images (height);
+            """,
+        )
+        file_filter = FileFilter()
+        file_filter.setValidExtensions(extensions)
+        self._filter = file_filter.compile()
+
+    def update(self, workers=8, batch=4096):
+        """
+        Bring the index up to date. Returns the number of probed files.
+        Files, whose header can't be parsed, are stored without properties.
+        """
+
+        db = self._db
+        rows = db.execute("SELECT path, mtime_ns, size FROM images")
+        known = {p: (m, s) for p, m, s in rows}
+        seen = set()
+        changed = []
+        for dirpath, dirs, files in walk_directory(self.root):
+            rel_dir = os.path.relpath(dirpath, self.root)
+            for file in self._filter.filterMany(files):
+                rel = file if rel_dir == "." else os.path.join(rel_dir, file)
+                try:
+                    st = os.stat(os.path.join(dirpath, file))
+                except OSError:
+                    continue
+                seen.add(rel)
+                sig = (st.st_mtime_ns, st.st_size)
+                if known.get(rel) != sig:
+                    changed.append((rel, sig))
+
+        empty = (None,) * len(ImageInfo._fields)
+        rows = []
+        with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+            for start in range(0, len(changed), batch):
+                part = changed[start : start + batch]
+                infos = pool.map(
+                    lambda item: probe_image(os.path.join(self.root, item[0])), part
+                )
+                for (rel, sig), info in zip(part, infos):
+                    rows.append((rel, sig[0], sig[1]) + tuple(info or empty))
+        with db:
+            db.executemany(
+                "INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows
+            )
+            db.executemany(
+                "DELETE FROM images WHERE path = ?",
+                [(p,) for p in known if p not in seen],
+            )
+        return len(changed)
+
+    def query(self, where=None, *params, refresh=False):
+        """
+        Return `(file name, ImageInfo)` tuples (sorted by path) of all indexed
+        images matching the SQL condition `where` with `?` placeholders
+        for `params` (all probed images for `where == None`).
+
+        Parameters:
+            :refresh: call `update` first
+        """
+
+        if refresh:
+            self.update()
+        sql = (
+            "SELECT path, format, width, height, channels, depth FROM images"
+            " WHERE format IS NOT NULL"
+        )
+        if where:
+            sql += f" AND ({where})"
+        sql += " ORDER BY path"
+        return [
+            (os.path.join(self.root, row[0]), ImageInfo(*row[1:]))
+            for row in self._db.execute(sql, params)
+        ]
@@ -1,13 +1,141 @@
+import collections
+import concurrent.futures
 import os
+import struct
+import tarfile
+import threading
+import zipfile
 from pathlib import Path
 import cv2
+import numpy as np
+from mbeex.base.cache import DefaultCache, LRUCache
+from mbeex.image.base import ImageException
 
 
 def _s(fname):  # OpenCV doesn't understand Path objects
     return str(fname)
 
 
-def read_image(fname, enforce_color=False):
+class ImageCache(LRUCache):
+    """
+    Thread-safe LRU cache of decoded images for `read_image` (see
+    `mbeex.base.cache.LRUCache`).
+
+    Entries are keyed by absolute path, modification time, file size and
+    decode flags, so changed files are decoded again. Least recently used
+    entries are evicted, when the summed size of the cached arrays exceeds
+    `max_bytes` (larger images are not cached at all).
+
+    Parameters:
+        :max_bytes: memory budget
+        :read_only: if True, cached arrays are shared and made read-only
+                    (`img.flags.writeable == False`; copy before modifying).
+                    Otherwise every caller gets a private copy.
+    """
+
+    def __init__(self, max_bytes=256 * 2**20, read_only=True):
+        super().__init__(max_bytes)
+        self.read_only = read_only
+
+    @staticmethod
+    def key(fname, flags):
+        """Cache key of a file or None, if it is not accessible"""
+
+        try:
+            st = os.stat(fname)
+        except OSError:
+            return None
+        return os.path.abspath(fname), st.st_mtime_ns, st.st_size, flags
+
+    def get(self, key):
+        """Cached image for `key` or None"""
+
+        img = super().get(key)
+        return img if img is None or self.read_only else img.copy()
+
+    def put(self, key, img):
+        """Insert `img`; returns the array to hand out to the caller"""
+
+        if img.nbytes > self.max_bytes:
+            return img
+        if self.read_only:
+            img.flags.writeable = False
+            super().put(key, img)
+        else:
+            super().put(key, img.copy())
+        return img
+
+
+_image_cache = DefaultCache()
+
+
+def set_image_cache(cache):
+    """
+    Set the default `ImageCache` of `read_image` (None disables caching).
+    Returns the previous cache.
+    """
+
+    return _image_cache.set(cache)
+
+
+def get_image_cache():
+    """Return the default `ImageCache` of `read_image` (or None)"""
+
+    return _image_cache.cache
+
+
+_REDUCED_COLOR = [
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+]
+
+
+def _decode_flags(enforce_color, reduce):
+    """
+    Returns `(imread flags, remaining reduction factor)`. Color decoding maps
+    (parts of) the reduction to OpenCV's `IMREAD_REDUCED_COLOR_*` flags.
+    """
+
+    if reduce < 1:
+        raise ValueError(f"invalid reduction factor: {reduce}")
+    if not enforce_color:
+        return cv2.IMREAD_UNCHANGED, reduce
+    for n, flags in _REDUCED_COLOR:
+        if reduce % n == 0:
+            return flags, reduce // n
+    return cv2.IMREAD_COLOR, reduce
+
+
+def _shrink(img, factor):
+    """
+    Downscale `img` by the integer `factor` (per axis); sizes are rounded up
+    like OpenCV's reduced JPEG decoding (`IMREAD_REDUCED_*`)
+    """
+
+    if img is None or factor <= 1:
+        return img
+    h, w = img.shape[:2]
+    size = (-(-w // factor), -(-h // factor))  # ceil
+    return cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+
+
+def _crop(img, roi, reduce):
+    """
+    Copy of the `roi` ([x0,y0,x1,y1], full resolution) of a reduced image,
+    clipped to the image; raises a `ValueError` for an empty region
+    """
+
+    h, w = img.shape[:2]
+    x0, y0, x1, y1 = roi
+    x0, y0 = max(0, x0 // reduce), max(0, y0 // reduce)
+    x1, y1 = min(w, -(-x1 // reduce)), min(h, -(-y1 // reduce))  # ceil
+    if x1 <= x0 or y1 <= y0:
+        raise ValueError(f"empty ROI {list(roi)} for image size {(h, w)}")
+    return img[y0:y1, x0:x1].copy()
+
+
+def read_image(fname, enforce_color=False, cache=None, reduce=1, roi=None):
     """
     Read image from file.
     
@@ -16,12 +144,34 @@ def read_image(fname, enforce_color=False):
         :enforce_color: if True, the image is converted to BGR: 
             2 color channels are added for grayscale images, an alpha 
             channel is ignored for corresponding formats.
+        :cache: `ImageCache` to use, False to bypass caching or None for
+            the default cache (see `set_image_cache`; disabled by default)
+        :reduce: integer downscale factor (per axis). With `enforce_color`,
+            factors 2, 4 and 8 are decoded by OpenCV's reduced decoders
+            (JPEG decodes at reduced size directly). Remaining factors and
+            non-color images (keeping alpha and bit depth) are decoded at
+            full size and shrunk with `cv2.INTER_AREA`.
+        :roi: optional rect. ROI `[x0,y0,x1,y1]` in full resolution
+            coordinates, clipped to the image; only a copy of this region
+            is returned, so the decoded full buffer is released (unless
+            cached). Raises a `ValueError` if the clipped region is empty.
     """
 
-    f = cv2.IMREAD_UNCHANGED
-    if enforce_color:
-        f = cv2.IMREAD_COLOR
-    ret = cv2.imread(_s(fname), flags=f)
+    f, rest = _decode_flags(enforce_color, reduce)
+    if cache is None:
+        cache = _image_cache.cache
+    key = None
+    ret = None
+    if cache:
+        key = ImageCache.key(_s(fname), (f, reduce))
+        if key is not None:
+            ret = cache.get(key)
+    if ret is None:
+        ret = _shrink(cv2.imread(_s(fname), flags=f), rest)
+        if key is not None and ret is not None:
+            ret = cache.put(key, ret)
+    if ret is not None and roi is not None:
+        ret = _crop(ret, roi, reduce)
     # TODO: Make a decision regarding general RGB/BGR handling
     # if len(ret.shape) > 2:
     #   if ret.shape[2] == 3:
@@ -31,17 +181,425 @@ def read_image(fname, enforce_color=False):
     return ret
 
 
-def write_image(fname, img):
+def decode_image(data, enforce_color=False, reduce=1):
+    """
+    Decode an image from memory (`bytes` or buffer with the encoded file
+    content, e.g. an archive member). Returns None for undecodable data.
+    `enforce_color` and `reduce`: see `read_image`.
+    """
+
+    f, rest = _decode_flags(enforce_color, reduce)
+    return _shrink(cv2.imdecode(np.frombuffer(data, dtype=np.uint8), f), rest)
+
+
+def _read_checked(fname, enforce_color, reduce):
+    img = read_image(fname, enforce_color, reduce=reduce)
+    if img is None:
+        raise ImageException(f"unreadable image: {fname}")
+    return img
+
+
+def _decode_checked(name, data, enforce_color, reduce):
+    img = decode_image(data, enforce_color, reduce)
+    if img is None:
+        raise ImageException(f"unreadable image: {name}")
+    return img
+
+
+def _decode_concurrently(tasks, decode, workers, ordered, prefetch, errors):
+    """
+    Apply `decode(*task)` to `tasks` (iterable of tuples starting with the
+    name) on a thread pool with at most `prefetch` tasks in flight and
+    yield `(name, img)`. See `read_images` for the remaining parameters.
+    """
+
+    if not prefetch:
+        prefetch = 2 * workers
+    tasks = iter(tasks)
+    pending = collections.OrderedDict()  # future -> name
+    pool = concurrent.futures.ThreadPoolExecutor(workers)
+
+    def submit():
+        for task in tasks:
+            pending[pool.submit(decode, *task)] = task[0]
+            if len(pending) >= prefetch:
+                break
+
+    def result(future):
+        name = pending.pop(future)
+        try:
+            return name, future.result()
+        except Exception as e:
+            if errors is None:
+                if isinstance(e, ImageException):
+                    raise
+                raise ImageException(f"unreadable image: {name} ({e})") from e
+            errors.append((name, str(e)))
+            return name, None
+
+    try:
+        submit()
+        while pending:
+            if ordered:
+                done = [next(iter(pending))]
+            else:
+                done, _ = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+            for future in done:
+                name, img = result(future)
+                if img is not None:
+                    yield name, img
+            submit()
+    finally:
+        for future in pending:
+            future.cancel()
+        pool.shutdown()
+
+
+def read_images(
+    fnames,
+    workers=4,
+    enforce_color=False,
+    ordered=True,
+    prefetch=None,
+    errors=None,
+    reduce=1,
+):
+    """
+    Read many images concurrently (OpenCV releases the GIL while decoding).
+    Yields `(fname, img)` tuples.
+
+    Parameters:
+        :fnames:        iterable of strings or Path objects
+        :workers:       number of decoding threads
+        :enforce_color: see `read_image`
+        :ordered:       yield in input order (otherwise as decoded)
+        :prefetch:      maximum number of images decoded ahead (default: 2*workers)
+        :errors:        list receiving `(fname, message)` for unreadable files,
+                        which are skipped then. Without it, an `ImageException`
+                        is raised for the first unreadable file.
+        :reduce:        see `read_image`
+    """
+
+    return _decode_concurrently(
+        ((fname, enforce_color, reduce) for fname in fnames),
+        _read_checked,
+        workers,
+        ordered,
+        prefetch,
+        errors,
+    )
+
+
+def _shard_members(shard_file, filter, args):
+    """
+    Yield `(name, data)` for the regular members of a tar or zip archive
+    passing `filter(name, *args)`, in archive order. Tar archives (also
+    compressed ones) are streamed, i.e. read strictly sequentially.
+    """
+
+    if zipfile.is_zipfile(shard_file):
+        with zipfile.ZipFile(shard_file) as zf:
+            infos = sorted(zf.infolist(), key=lambda i: i.header_offset)
+            for info in infos:
+                if info.is_dir() or (
+                    filter is not None and not filter(info.filename, *args)
+                ):
+                    continue
+                yield info.filename, zf.read(info)
+        return
+    with tarfile.open(shard_file, mode="r|*") as tf:
+        for member in tf:
+            if not member.isfile() or (
+                filter is not None and not filter(member.name, *args)
+            ):
+                continue
+            yield member.name, tf.extractfile(member).read()
+
+
+def read_shard(
+    shard_file,
+    filter=None,
+    *args,
+    workers=4,
+    enforce_color=False,
+    ordered=True,
+    prefetch=None,
+    errors=None,
+    reduce=1,
+):
+    """
+    Read the images of a tar or zip shard archive (see
+    `mbeex.image.shard.write_shards`): members are read sequentially and
+    decoded from memory by `workers` threads. Yields `(member_name, img)`.
+
+    Parameters:
+        :shard_file: tar (optionally gzip/bz2/xz compressed) or zip file
+        :filter:     optional `filter(member_name, *args) -> bool` selecting
+                     the members to decode (e.g. a `CompiledFileFilter` to
+                     skip non-image members); all members for None
+        :return:     see `read_images` for the remaining parameters
+    """
+
+    return _decode_concurrently(
+        (
+            (name, data, enforce_color, reduce)
+            for name, data in _shard_members(shard_file, filter, args)
+        ),
+        _decode_checked,
+        workers,
+        ordered,
+        prefetch,
+        errors,
+    )
+
+
+ImageInfo = collections.namedtuple(
+    "ImageInfo", ["format", "width", "height", "channels", "depth"]
+)
+ImageInfo.__doc__ = """
+Image properties from a file header (see `probe_image`). `channels` and
+`depth` (bits per channel) describe the array `read_image` returns.
+"""
+
+
+def _probe_png(fh):
+    fh.seek(8)
+    length, ctype = struct.unpack(">I4s", fh.read(8))
+    if ctype != b"IHDR":
+        return None
+    width, height, bits, color = struct.unpack(">IIBB", fh.read(10))
+    channels = {0: 1, 2: 3, 3: 3, 4: 4, 6: 4}.get(color)
+    if channels == 3:  # transparency chunk -> OpenCV adds alpha
+        fh.seek(8 + 8 + length + 4)
+        while True:
+            head = fh.read(8)
+            if len(head) < 8:
+                break
+            length, ctype = struct.unpack(">I4s", head)
+            if ctype == b"tRNS":
+                channels = 4
+            if ctype in (b"tRNS", b"IDAT", b"IEND"):
+                break
+            fh.seek(length + 4, os.SEEK_CUR)
+    return ImageInfo("png", width, height, channels, 16 if bits == 16 else 8)
+
+
+_JPEG_SOF = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+def _probe_jpeg(fh):
+    fh.seek(2)
+    while True:
+        b = fh.read(1)
+        while b and b != b"\xff":  # skip fill bytes / garbage
+            b = fh.read(1)
+        while b == b"\xff":
+            b = fh.read(1)
+        if not b:
+            return None
+        marker = b[0]
+        if marker in (0x01, 0xD8) or 0xD0 <= marker <= 0xD7:  # no payload
+            continue
+        (length,) = struct.unpack(">H", fh.read(2))
+        if marker in _JPEG_SOF:
+            _, height, width, components = struct.unpack(">BHHB", fh.read(6))
+            channels = 1 if components == 1 else 3
+            return ImageInfo("jpeg", width, height, channels, 8)
+        fh.seek(length - 2, os.SEEK_CUR)
+
+
+def _probe_tiff(fh, order):
+    fh.seek(4)
+    (offset,) = struct.unpack(order + "I", fh.read(4))
+    fh.seek(offset)
+    (n,) = struct.unpack(order + "H", fh.read(2))
+    tags = {}
+    for _ in range(n):
+        tag, typ, count, value = struct.unpack(order + "HHI4s", fh.read(12))
+        if typ == 3:  # SHORT
+            if count > 2:
+                pos = fh.tell()
+                fh.seek(struct.unpack(order + "I", value)[0])
+                value = fh.read(2)
+                fh.seek(pos)
+            tags[tag] = struct.unpack(order + "H", value[:2])[0]
+        elif typ == 4:  # LONG
+            tags[tag] = struct.unpack(order + "I", value)[0]
+    if 256 not in tags or 257 not in tags:
+        return None
+    return ImageInfo("tiff", tags[256], tags[257], tags.get(277, 1), tags.get(258, 1))
+
+
+def probe_image(fname):
+    """
+    Determine format, size, channel count and bit depth of a PNG, JPEG or
+    TIFF file by reading its header only (no decoding).
+    Returns an `ImageInfo` or None for other formats and unreadable files.
+    """
+
+    try:
+        with open(_s(fname), "rb") as fh:
+            head = fh.read(8)
+            if head == b"\x89PNG\r\n\x1a\n":
+                return _probe_png(fh)
+            if head[:2] == b"\xff\xd8":
+                return _probe_jpeg(fh)
+            if head[:4] == b"II*\x00":
+                return _probe_tiff(fh, "<")
+            if head[:4] == b"MM\x00*":
+                return _probe_tiff(fh, ">")
+    except (OSError, struct.error):
+        pass
+    return None
+
+
+def write_image(fname, img, params=None):
     """
     Write image to file and create all intermediate directories, if not existing.
 
     Parameters:
         :fname: string or Path object
         :img: img object to write
+        :params: optional OpenCV encode parameters (see `encode_params`)
     """
 
     path = Path(fname)
     dir = path.parent
     if not dir.exists():
         os.makedirs(dir)
-    cv2.imwrite(_s(fname), img)
+    if params:
+        return cv2.imwrite(_s(fname), img, params)
+    return cv2.imwrite(_s(fname), img)
+
+
+def encode_params(png_compression=None, jpeg_quality=None, webp_quality=None):
+    """
+    Return `{extension: OpenCV imwrite parameter list}` for the given
+    settings (speed/size trade-offs). Unset values keep OpenCV's defaults.
+
+    Parameters:
+        :png_compression: 0 (fast, large) ... 9 (slow, small)
+        :jpeg_quality:    0 ... 100
+        :webp_quality:    1 ... 100
+    """
+
+    ret = {}
+    if png_compression is not None:
+        ret[".png"] = [cv2.IMWRITE_PNG_COMPRESSION, int(png_compression)]
+    if jpeg_quality is not None:
+        for ext in (".jpg", ".jpeg", ".jpe"):
+            ret[ext] = [cv2.IMWRITE_JPEG_QUALITY, int(jpeg_quality)]
+    if webp_quality is not None:
+        ret[".webp"] = [cv2.IMWRITE_WEBP_QUALITY, int(webp_quality)]
+    return ret
+
+
+class ImageWriter:
+    """
+    Asynchronous image writer: images are encoded and written by a
+    background thread pool. At most `max_pending` images wait for writing;
+    `write` blocks, if the queue is full. Created directories are remembered,
+    so the existence check happens once per directory.
+
+    Failed writes are collected; `flush` (also called by `close` and
+    at the end of a `with` block) waits for all pending writes and raises
+    an `ImageException`, if any write failed since the last flush.
+
+    The caller must not modify an image after passing it to `write`
+    (or use `copy=True`).
+
+        with ImageWriter(png_compression=1) as writer:
+            for fname, img in results:
+                writer.write(fname, img)
+
+    Parameters:
+        :workers:     number of encoding threads
+        :max_pending: maximum number of queued images
+        :params:      `{extension: OpenCV imwrite parameters}`, see `encode_params`,
+                      whose keyword arguments are accepted here as well
+    """
+
+    def __init__(self, workers=2, max_pending=16, params=None, **encode_options):
+        self.params = encode_params(**encode_options)
+        self.params.update(params or {})
+        self._pool = concurrent.futures.ThreadPoolExecutor(workers)
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._dirs = set()
+        self._pending = set()
+        self._errors = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:  # don't hide the original exception
+            self._pool.shutdown()
+
+    def _makedirs(self, dir):
+        if dir in self._dirs:
+            return
+        os.makedirs(dir, exist_ok=True)
+        with self._lock:
+            self._dirs.add(dir)
+
+    def _write(self, fname, img):
+        try:
+            self._makedirs(os.path.dirname(os.path.abspath(fname)))
+            params = self.params.get(os.path.splitext(fname)[1].lower())
+            if params:
+                ok = cv2.imwrite(fname, img, params)
+            else:
+                ok = cv2.imwrite(fname, img)
+            if not ok:
+                raise ImageException(f"cannot write image: {fname}")
+        except Exception as e:
+            with self._lock:
+                self._errors.append((fname, str(e)))
+        finally:
+            self._slots.release()
+
+    def _done(self, future):
+        with self._lock:
+            self._pending.discard(future)
+
+    def write(self, fname, img, copy=False):
+        """Queue `img` for writing to `fname` (string or Path object)"""
+
+        fname = _s(fname)
+        if copy:
+            img = img.copy()
+        self._slots.acquire()
+        future = self._pool.submit(self._write, fname, img)
+        with self._lock:
+            self._pending.add(future)
+        future.add_done_callback(self._done)
+
+    def flush(self):
+        """
+        Wait for all queued images. Raises an `ImageException` listing
+        the failed writes since the last flush.
+        """
+
+        with self._lock:
+            pending = list(self._pending)
+        concurrent.futures.wait(pending)
+        with self._lock:
+            errors, self._errors = self._errors, []
+        if errors:
+            raise ImageException(
+                f"{len(errors)} image(s) not written, first: {errors[0][0]}: "
+                f"{errors[0][1]}"
+            )
+
+    def close(self):
+        """Flush and stop the worker threads"""
+
+        try:
+            self.flush()
+        finally:
+            self._pool.shutdown()
@@ -0,0 +1,136 @@
+#
+import os
+import numpy as np
+from mbeex.base.directory import filter_directory
+from mbeex.image.base import ImageException
+from mbeex.image.io import read_images
+
+
+"""
+Packed image datasets: many images in one contiguous raw file plus an
+index (offsets, shapes, dtypes, names), read back as zero-copy views of a
+memory mapping. Repeated reads cost page cache accesses instead of decodes.
+"""
+
+ALIGNMENT = 64  # byte alignment of every image in the pack file
+
+
+def _index_file(pack_file):
+    return os.fspath(pack_file) + ".index.npz"
+
+
+def pack_images(
+    root, pack_file, filter=None, *args, enforce_color=False, workers=4, errors=None
+):
+    """
+    Decode all images below `root` passing `filter(file_name, *args)`
+    (see `filter_directory`) and store their pixel data in `pack_file`, the
+    index in `pack_file + ".index.npz"`. Images are streamed, the pack is
+    never held in memory completely.
+
+    Parameters:
+        :enforce_color: see `read_image`
+        :workers:       number of decoding threads
+        :errors:        list receiving `(fname, message)` for unreadable
+                        files (skipped); without it, they raise an `ImageException`
+        :return:        number of packed images
+    """
+
+    files = filter_directory(root, filter, *args)
+    names, offsets, shapes, dtypes = [], [], [], []
+    offset = 0
+    with open(pack_file, "wb") as fh:
+        for fname, img in read_images(
+            files, workers=workers, enforce_color=enforce_color, errors=errors
+        ):
+            pad = -offset % ALIGNMENT
+            if pad:
+                fh.write(bytes(pad))
+                offset += pad
+            img = np.ascontiguousarray(img)
+            fh.write(img.data)
+            names.append(os.path.relpath(fname, root))
+            offsets.append(offset)
+            shapes.append(img.shape + (0,) * (3 - img.ndim))
+            dtypes.append(img.dtype.str)
+            offset += img.nbytes
+    np.savez(
+        _index_file(pack_file),
+        names=np.array(names, dtype=str),
+        offsets=np.array(offsets, dtype=np.int64),
+        shapes=np.array(shapes, dtype=np.int64).reshape(-1, 3),
+        dtypes=np.array(dtypes, dtype=str),
+    )
+    return len(names)
+
+
+class PackedImages:
+    """
+    Read access to a pack created by `pack_images`. Items are read-only
+    `numpy` views into a memory mapping of the pack file (no copies, no
+    decoding):
+
+        pack = PackedImages("train.pack")
+        img = pack[17]          # single image
+        imgs = pack[10:20]      # list of images
+        batch = pack.batch(10, 20)  # (N,H,W[,C]) array
+    """
+
+    def __init__(self, pack_file):
+        with np.load(_index_file(pack_file)) as index:
+            self.names = list(index["names"])
+            self._offsets = index["offsets"]
+            self._shapes = index["shapes"]
+            self._dtypes = [np.dtype(d) for d in index["dtypes"]]
+        if os.path.getsize(pack_file):
+            self._data = np.memmap(pack_file, dtype=np.uint8, mode="r")
+        else:
+            self._data = np.empty(0, np.uint8)  # empty files cannot be mapped
+        self._lookup = None
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def shape(self, i):
+        """Shape of image `i` (without reading it)"""
+
+        return tuple(int(n) for n in self._shapes[i] if n)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        shape = self.shape(i)
+        dtype = self._dtypes[i]
+        start = int(self._offsets[i])
+        nbytes = int(np.prod(shape)) * dtype.itemsize
+        return self._data[start : start + nbytes].view(dtype).reshape(shape)
+
+    def index(self, name):
+        """Index of the image with relative file name `name`"""
+
+        if self._lookup is None:
+            self._lookup = {n: i for i, n in enumerate(self.names)}
+        return self._lookup[name]
+
+    def batch(self, start, stop):
+        """
+        Images `start..stop-1` as one `(N,H,W[,C])` array. Images of equal
+        shape and dtype are evenly spaced in the pack, so the result is
+        a strided zero-copy view. Raises an `ImageException` for mixed shapes.
+        """
+
+        start, stop, _ = slice(start, stop).indices(len(self))
+        n = max(0, stop - start)
+        if n == 0:
+            raise ImageException("empty batch")
+        first = self[start]
+        shapes = self._shapes[start : start + n]
+        if (shapes != shapes[0]).any() or len(set(self._dtypes[start : start + n])) > 1:
+            raise ImageException("batch of images with different shapes or types")
+        offsets = self._offsets[start : start + n]
+        step = int(offsets[1] - offsets[0]) if n > 1 else first.nbytes
+        if n > 1 and (np.diff(offsets) != step).any():
+            return np.stack(self[start : start + n])  # not evenly spaced
+        return np.lib.stride_tricks.as_strided(
+            first, shape=(n,) + first.shape, strides=(step,) + first.strides
+        )
@@ -1,7 +1,9 @@
 import cv2
 import numpy as np
-import matplotlib.pyplot as plt
 import copy
+from mbeex.base.lazy import lazy_import
+
+plt = lazy_import("matplotlib.pyplot")
 
 
 """
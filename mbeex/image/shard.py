@@ -0,0 +1,134 @@
+#
+import os
+import tarfile
+import zipfile
+from mbeex.base.directory import DirectoryWalker
+
+
+"""
+Shard archives: many small (image) files stored in a few large tar or zip
+files, which are read sequentially (see `mbeex.image.io.read_shard`)
+instead of opening millions of single files.
+"""
+
+
+class ShardWriter:
+    """
+    `DirectoryWalker` functor appending the walked files to a sequence of
+    uncompressed shard archives `<dst_dir>/<prefix>-000000.tar`, ... A new
+    shard is started, when the current one would exceed `max_files` files
+    or `max_bytes` bytes. Member names are the paths relative to `src_dir`
+    (with "/" separators). Files are stored in walk order, so files of the
+    same directory stay adjacent.
+
+    Call `close` after the walk; `shards` lists the written archives.
+
+    Parameters:
+        :src_dir:   root of the walked tree
+        :dst_dir:   output directory
+        :prefix:    shard file name prefix
+        :format:    "tar" or "zip" (stored, no compression)
+        :max_files: maximum number of files per shard
+        :max_bytes: maximum (uncompressed) size of a shard
+        :filter:    optional `filter(file_name, *args) -> bool` selecting files
+    """
+
+    def __init__(
+        self,
+        src_dir,
+        dst_dir,
+        prefix="shard",
+        format="tar",
+        max_files=10000,
+        max_bytes=2**30,
+        filter=None,
+        *args,
+    ):
+        if format not in ("tar", "zip"):
+            raise ValueError(f"unknown shard format: {format}")
+        self.src_dir = src_dir
+        self.dst_dir = dst_dir
+        self.prefix = prefix
+        self.format = format
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self.filter = filter
+        self.args = args
+        self.shards = []
+        self._archive = None
+        self._files = 0
+        self._bytes = 0
+
+    def _next(self):
+        self.close()
+        name = f"{self.prefix}-{len(self.shards):06d}.{self.format}"
+        path = os.path.join(self.dst_dir, name)
+        if self.format == "tar":
+            self._archive = tarfile.open(path, "w", format=tarfile.PAX_FORMAT)
+        else:
+            self._archive = zipfile.ZipFile(path, "w", zipfile.ZIP_STORED)
+        self.shards.append(path)
+        self._files = 0
+        self._bytes = 0
+
+    def __call__(self, ifile, structure=None):
+        if self.filter is not None and not self.filter(ifile, *self.args):
+            return
+        size = os.path.getsize(ifile)
+        if (
+            self._archive is None
+            or self._files >= self.max_files
+            or (self._files and self._bytes + size > self.max_bytes)
+        ):
+            self._next()
+        name = os.path.relpath(ifile, self.src_dir).replace(os.sep, "/")
+        if self.format == "tar":
+            self._archive.add(ifile, arcname=name, recursive=False)
+        else:
+            self._archive.write(ifile, arcname=name)
+        self._files += 1
+        self._bytes += size
+
+    def close(self):
+        """Finish the current shard"""
+
+        if self._archive is not None:
+            self._archive.close()
+            self._archive = None
+
+
+def write_shards(
+    src_dir,
+    dst_dir,
+    filter=None,
+    *args,
+    prefix="shard",
+    format="tar",
+    max_files=10000,
+    max_bytes=2**30,
+    shard_index=0,
+    shard_count=1,
+    print_progress=False,
+):
+    """
+    Store all files below `src_dir` passing `filter(file_name, *args)` in
+    shard archives in `dst_dir` (see `ShardWriter`) and return their file
+    names.
+
+    The walk can be split over several machines like every `DirectoryWalker`
+    job (`shard_index` of `shard_count`, see `DirectoryWalker.setShard`);
+    each of them writes its own archives `<prefix>-<i>of<n>-000000.tar`, ...
+    """
+
+    os.makedirs(dst_dir, exist_ok=True)
+    if shard_count > 1:
+        prefix = f"{prefix}-{shard_index}of{shard_count}"
+    walker = DirectoryWalker(src_dir, None, shard_index, shard_count)
+    writer = ShardWriter(
+        src_dir, dst_dir, prefix, format, max_files, max_bytes, filter, *args
+    )
+    try:
+        walker.run(writer, print_progress=print_progress)
+    finally:
+        writer.close()
+    return writer.shards
@@ -0,0 +1,193 @@
+#
+import collections
+import contextlib
+import threading
+import weakref
+from multiprocessing import shared_memory
+import numpy as np
+from mbeex.image.base import ImageException
+
+
+"""
+Image exchange between processes via shared memory: instead of pickling
+arrays, the owning process copies (or lets workers write) images into
+`multiprocessing.shared_memory` blocks and passes small `SharedImage`
+handles; workers map the blocks with `attach_image`.
+
+    with SharedImagePool() as pool:
+        handle = pool.put(img)
+        executor.submit(work, handle)  # work: with attach_image(handle) as img: ...
+        ...
+        pool.release(handle)
+"""
+
+SharedImage = collections.namedtuple("SharedImage", ["name", "shape", "dtype"])
+SharedImage.__doc__ = """
+Picklable handle of an image in a shared memory block (see `SharedImagePool`):
+block name, array shape and dtype string.
+"""
+
+MIN_BLOCK_SIZE = 2**16  # smallest block size class (bytes)
+
+
+def _block_size(nbytes):
+    """Size class of a block holding `nbytes` bytes (power of two)"""
+
+    return max(MIN_BLOCK_SIZE, 1 << max(nbytes - 1, 0).bit_length())
+
+
+def _nbytes(shape, dtype):
+    return int(np.prod(shape, dtype=np.int64)) * np.dtype(dtype).itemsize
+
+
+def _attach(name):
+    try:
+        # attaching processes must not unlink the block on exit (Python >= 3.13)
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name)
+
+
+def _close(shm):
+    try:
+        shm.close()
+    except BufferError:
+        pass  # arrays still reference the mapping, it is released with them
+
+
+@contextlib.contextmanager
+def attach_image(handle):
+    """
+    Context manager mapping the image of a `SharedImage` handle (in any
+    process) and returning it as writable `numpy` array without copying:
+
+        with attach_image(handle) as img:
+            img[...] = 255 - img
+
+    Do not keep references to the array beyond the `with` block (copy
+    the data, if needed).
+    """
+
+    shm = _attach(handle.name)
+    try:
+        yield np.ndarray(handle.shape, dtype=handle.dtype, buffer=shm.buf)
+    finally:
+        _close(shm)
+
+
+def _cleanup(blocks):
+    for shm in blocks.values():
+        _close(shm)
+        try:
+            shm.unlink()
+        except FileNotFoundError:
+            pass
+    blocks.clear()
+
+
+class SharedImagePool:
+    """
+    Owner of shared memory blocks for exchanging images with worker
+    processes. Released blocks are kept (up to `max_free_bytes`) and reused
+    for later images of the same size class, so steady pipelines do not
+    create and map new blocks per image.
+
+    All blocks are unlinked by `close` (also called on exit of a `with`
+    block, when the pool is garbage collected and at interpreter exit);
+    a closed pool cannot allocate blocks anymore. Thread safe.
+
+    Parameters:
+        :max_free_bytes: maximum total size of kept released blocks
+    """
+
+    def __init__(self, max_free_bytes=512 * 2**20):
+        self.max_free_bytes = max_free_bytes
+        self._blocks = {}  # name -> SharedMemory (all owned blocks)
+        self._free = collections.defaultdict(list)  # size class -> [name]
+        self._released = set()  # names of all free blocks
+        self._free_bytes = 0
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+        self._closed = False
+        self._finalizer = weakref.finalize(self, _cleanup, self._blocks)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def allocate(self, shape, dtype=np.uint8):
+        """
+        Return the handle of an (uninitialized) image block, e.g. as
+        output buffer of a worker. Raises an `ImageException`, if the pool
+        is closed.
+        """
+
+        size = _block_size(_nbytes(shape, dtype))
+        with self._lock:
+            if self._closed:
+                raise ImageException("shared image pool is closed")
+            if self._free[size]:
+                name = self._free[size].pop()
+                self._released.remove(name)
+                self._free_bytes -= size
+                self.reused += 1
+            else:
+                shm = shared_memory.SharedMemory(create=True, size=size)
+                name = shm.name
+                self._blocks[name] = shm
+                self.created += 1
+        return SharedImage(name, tuple(int(n) for n in shape), np.dtype(dtype).str)
+
+    def put(self, img):
+        """Copy `img` into a block and return its handle"""
+
+        handle = self.allocate(img.shape, img.dtype)
+        self.array(handle)[...] = img
+        return handle
+
+    def array(self, handle):
+        """`numpy` view of a block of this pool (no copy)"""
+
+        shm = self._blocks[handle.name]
+        return np.ndarray(handle.shape, dtype=handle.dtype, buffer=shm.buf)
+
+    def get(self, handle):
+        """Copy of the image of `handle`; the block is released"""
+
+        img = self.array(handle).copy()
+        self.release(handle)
+        return img
+
+    def release(self, handle):
+        """
+        Return the block of `handle` to the pool (for reuse by later images).
+        Raises an `ImageException` for handles of other pools and for
+        blocks already released (e.g. by `get`).
+        """
+
+        with self._lock:
+            shm = self._blocks.get(handle.name)
+            if shm is None or handle.name in self._released:
+                raise ImageException(f"unknown or released shared image: {handle.name}")
+            size = _block_size(_nbytes(handle.shape, handle.dtype))
+            if self._free_bytes + size <= self.max_free_bytes:
+                self._free[size].append(handle.name)
+                self._released.add(handle.name)
+                self._free_bytes += size
+                return
+            del self._blocks[handle.name]
+        _close(shm)
+        shm.unlink()
+
+    def close(self):
+        """Unlink all blocks (also those in use)"""
+
+        with self._lock:
+            self._closed = True
+            self._free.clear()
+            self._released.clear()
+            self._free_bytes = 0
+            self._finalizer()
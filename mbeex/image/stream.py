@@ -0,0 +1,272 @@
+#
+import collections
+import threading
+import time
+import traceback
+import cv2
+from mbeex.base.progress import ProgressMeter
+from mbeex.image.base import ImageException
+
+
+"""
+Threaded frame streaming: a decode thread reads frames of a video file or
+camera (`cv2.VideoCapture`) into a ring buffer, processing stages run on
+worker threads connected by further ring buffers, and the caller iterates
+over the results (e.g. to display them):
+
+    stream = VideoStream("video.mp4", drop_oldest=True)
+    stream.addStage(lambda img: cv2.GaussianBlur(img, (5, 5), 0), "blur")
+    stream.addStage(lambda img: colormapped_image(img[..., 0], "jet"), "cmap")
+    with stream:
+        for frame in stream:
+            cv2.imshow("result", frame.image)
+            cv2.waitKey(1)
+"""
+
+Frame = collections.namedtuple("Frame", ["index", "time", "image"])
+Frame.__doc__ = """
+A streamed frame: frame number (in decode order), capture time
+(`time.monotonic()`) and the (processed) image.
+"""
+
+
+class FrameBuffer:
+    """
+    Thread safe bounded FIFO between two pipeline stages.
+
+    When the buffer is full, `put` either waits for the consumer (back
+    pressure reaches the producer) or, with `drop_oldest`, discards the
+    oldest buffered item (live sources: latency stays bounded, `dropped`
+    counts the discarded items).
+
+    Parameters:
+        :capacity:    maximum number of buffered items
+        :drop_oldest: drop instead of blocking when full
+    """
+
+    def __init__(self, capacity=8, drop_oldest=False):
+        if capacity < 1:
+            raise ValueError(f"invalid capacity: {capacity}")
+        self.capacity = capacity
+        self.drop_oldest = drop_oldest
+        self.dropped = 0
+        self._items = collections.deque()
+        self._cond = threading.Condition()
+        self._closed = False
+
+    def __len__(self):
+        return len(self._items)
+
+    def put(self, item):
+        """Append `item`; returns False (item discarded), if the buffer is closed"""
+
+        with self._cond:
+            while len(self._items) >= self.capacity and not self._closed:
+                if self.drop_oldest:
+                    self._items.popleft()
+                    self.dropped += 1
+                    break
+                self._cond.wait()
+            if self._closed:
+                return False
+            self._items.append(item)
+            self._cond.notify_all()
+            return True
+
+    def get(self, timeout=None):
+        """
+        Remove and return the oldest item. Returns None, if the buffer is
+        closed and empty; raises `TimeoutError` after `timeout` seconds.
+        """
+
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._items or self._closed, timeout):
+                raise TimeoutError("no frame available")
+            if not self._items:
+                return None
+            item = self._items.popleft()
+            self._cond.notify_all()
+            return item
+
+    def close(self, discard=False):
+        """
+        End of data: producers are rejected, consumers get the remaining
+        items (all dropped for `discard`) and then None.
+        """
+
+        with self._cond:
+            self._closed = True
+            if discard:
+                self._items.clear()
+            self._cond.notify_all()
+
+
+class _Stage:
+    def __init__(self, func, name, workers):
+        self.func = func
+        self.name = name
+        self.workers = workers
+        self.meter = ProgressMeter(name, output=False, measure_bytes=False)
+        self.lock = threading.Lock()
+        self.running = 0
+
+
+class VideoStream:
+    """
+    Frame source with a decode thread and optional processing stages
+    (see module documentation). Iterating yields `Frame`s in order of the
+    last stage (stages with several workers may reorder frames, see
+    `Frame.index`). Iteration ends with the video; a failing stage call
+    skips the frame and is recorded in `errors`.
+
+    Parameters:
+        :source:      video file name, camera index or an opened
+                      `cv2.VideoCapture` (released by the stream)
+        :buffer_size: capacity of each `FrameBuffer`
+        :drop_oldest: drop the oldest buffered frames, if a stage (or the
+                      consumer) is too slow, instead of throttling decoding;
+                      suitable for cameras, loses frames of video files
+    """
+
+    def __init__(self, source, buffer_size=8, drop_oldest=False):
+        self.source = source
+        self.buffer_size = buffer_size
+        self.drop_oldest = drop_oldest
+        self.errors = []  # (frame index, stage name, traceback)
+        self._stages = [_Stage(None, "decode", 1)]
+        self._buffers = []
+        self._threads = []
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def __iter__(self):
+        if not self._threads:
+            self.start()
+        while True:
+            frame = self.read()
+            if frame is None:
+                return
+            yield frame
+
+    def addStage(self, func, name=None, workers=1):
+        """
+        Append processing stage `func(img) -> img` with `workers` threads
+        (useful for functions releasing the GIL, like most OpenCV calls).
+        Returns the stream for chaining.
+        """
+
+        if self._threads:
+            raise ImageException("stages must be added before start")
+        if name is None:
+            name = getattr(func, "__name__", None) or f"stage{len(self._stages)}"
+        self._stages.append(_Stage(func, name, workers))
+        return self
+
+    def start(self):
+        """Open the source and start decoding and processing threads"""
+
+        if self._threads:
+            return
+        if isinstance(self.source, cv2.VideoCapture):
+            capture = self.source
+        else:
+            capture = cv2.VideoCapture(self.source)
+        if not capture.isOpened():
+            raise ImageException(f"cannot open video source: {self.source}")
+        self._buffers = [
+            FrameBuffer(self.buffer_size, self.drop_oldest) for _ in self._stages
+        ]
+        self._threads = [threading.Thread(target=self._decode, args=(capture,))]
+        for i, stage in enumerate(self._stages[1:], 1):
+            stage.running = stage.workers
+            self._threads += [
+                threading.Thread(target=self._process, args=(i,))
+                for _ in range(stage.workers)
+            ]
+        for stage in self._stages:
+            stage.meter.start()
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+
+    def read(self, timeout=None):
+        """Next `Frame` of the last stage (None at the end of the stream)"""
+
+        return self._buffers[-1].get(timeout)
+
+    def stop(self):
+        """Stop all threads (remaining frames are discarded)"""
+
+        for buffer in self._buffers:
+            buffer.close(discard=True)
+        for thread in self._threads:
+            thread.join()
+
+    def _decode(self, capture):
+        meter = self._stages[0].meter
+        out = self._buffers[0]
+        index = 0
+        try:
+            while True:
+                t0 = time.perf_counter()
+                ok, img = capture.read()
+                if not ok:
+                    break
+                now = time.perf_counter()
+                meter.update(latency=now - t0)
+                if not out.put(Frame(index, time.monotonic(), img)):
+                    break
+                index += 1
+        finally:
+            capture.release()
+            out.close()
+
+    def _process(self, i):
+        stage = self._stages[i]
+        src, out = self._buffers[i - 1], self._buffers[i]
+        try:
+            while True:
+                frame = src.get()
+                if frame is None:
+                    break
+                t0 = time.perf_counter()
+                try:
+                    img = stage.func(frame.image)
+                except Exception:
+                    with stage.lock:
+                        stage.meter.update(errors=1)
+                    self.errors.append(
+                        (frame.index, stage.name, traceback.format_exc())
+                    )
+                    continue
+                latency = time.perf_counter() - t0
+                with stage.lock:
+                    stage.meter.update(latency=latency)
+                if not out.put(frame._replace(image=img)):
+                    break
+        finally:
+            with stage.lock:
+                stage.running -= 1
+                if stage.running == 0:
+                    out.close()
+
+    def stats(self):
+        """
+        Per stage counters `{name: {...}}`: `JobSummary.asDict` values
+        (`files` = frames, `files_per_s` = fps, latencies per frame) plus
+        `dropped` (frames dropped from the stage's output buffer) and
+        `queued` (frames waiting in it)
+        """
+
+        ret = {}
+        for stage, buffer in zip(self._stages, self._buffers):
+            entry = stage.meter.summary().asDict()
+            entry["dropped"] = buffer.dropped
+            entry["queued"] = len(buffer)
+            ret[stage.name] = entry
+        return ret
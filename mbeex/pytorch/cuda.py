@@ -1,4 +1,6 @@
-import torch
+from mbeex.base.lazy import lazy_import
+
+torch = lazy_import("torch")
 
 
 class Cuda:
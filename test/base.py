@@ -1,6 +1,8 @@
+import shutil
 import cv2
 import albumentations as A
 from mbeex.base.directory import *
+from mbeex.base.progress import ProgressMeter
 from test import *
 
 
@@ -12,6 +14,65 @@ def _test_filter():
     print(fl)
 
 
+def _test_iter():
+    root = test_data_dir / "dirwalk"
+    expected = [
+        os.path.join(dirpath, file)
+        for dirpath, dirs, files in os.walk(root)
+        for file in files
+    ]
+    assert filter_directory(root, None) == expected
+    assert count_files(root) == len(expected)
+
+    it = iter_directory(root, lambda fname: fname.endswith(".png"))
+    first = next(it)
+    it.close()  # early stop
+    print(f"iter_directory: first match {first} of {len(expected)} files")
+
+
+def _test_file_filter():
+    ff = FileFilter()
+    ff.setValidExtensions(["png", "xml"])
+    ff.setValidSuffixes(["_PARTS", "_PARTS_BB", "_ST"])
+    cf = ff.compile()
+    names = ["a/X_PARTS.png", "a/X_PARTS_BB.xml", "a/X_ST.jpg", "a/X.png", "X_ST.PNG"]
+    assert cf.filterMany(names) == [n for n in names if ff.validFileName(n)]
+    assert cf.replaceSuffix("a/X_PARTS.png", "_ST") == ff.replaceSuffix(
+        "a/X_PARTS.png", "_ST"
+    )
+
+    root = test_data_dir / "dirwalk"
+    ff.setValidExtensions(["png"])
+    ff.setValidSuffixes(["mask", "_alpha"])
+    fl = filter_directory(root, ff.compile())
+    assert fl == filter_directory(root, ff.validFileName)
+    print(f"compiled file filter: {len(fl)} files found")
+
+
+def _test_index():
+    from mbeex.base.index import DirectoryIndex
+
+    root = out_dir / "dirwalk_index"
+    shutil.rmtree(root, ignore_errors=True)
+    shutil.copytree(test_data_dir / "dirwalk", root)
+    cache_dir = out_dir / "cache"
+    ff = FileFilter()
+    ff.setValidExtensions(["png"])
+    ff.setValidSuffixes(["mask", "_alpha"])
+
+    fl = filter_directory(root, ff.compile(), cache_dir=cache_dir)
+    assert sorted(fl) == sorted(filter_directory(root, ff.validFileName))
+
+    with open(root / "2" / "new_mask.png", "wb"):
+        pass
+    with DirectoryIndex(root, cache_dir) as index:
+        fl = index.query(ff.compile())
+        assert str(root / "2" / "new_mask.png") in fl
+        fl_all = index.query(None, refresh=False)
+        assert sorted(fl_all) == sorted(filter_directory(root, None))
+    print(f"directory index: {len(fl)} files found")
+
+
 def _test_walker():
     def resizeImage(ifile, ofile, scale_x, scale_y):
         """
@@ -28,8 +89,183 @@ def _test_walker():
     dw.createFilteredData(resizeImage, 0.5, 0.25)
 
 
+def _copy_or_fail(ifile, ofile):
+    if ifile.endswith("spiral.png"):
+        raise ValueError("refused")
+    with open(ifile, "rb") as i, open(ofile, "wb") as o:
+        o.write(i.read())
+    return os.path.getsize(ofile)
+
+
+def _test_parallel():
+    dw = DirectoryWalker(test_data_dir / "dirwalk", out_dir / "dirwalk_parallel")
+    for executor in ["thread", "process"]:
+        report = dw.createFilteredData(
+            _copy_or_fail, workers=2, executor=executor, chunksize=2, ordered=True
+        )
+        assert report.count == count_files(test_data_dir / "dirwalk")
+        assert len(report.errors) == 1 and "refused" in report.errors[0][1]
+        print(f"parallel ({executor}): {len(report.results)} copied, 1 error reported")
+
+
+def _test_incremental():
+    src = out_dir / "dirwalk_incremental_src"
+    dst = out_dir / "dirwalk_incremental"
+    shutil.rmtree(src, ignore_errors=True)
+    shutil.rmtree(dst, ignore_errors=True)
+    shutil.copytree(test_data_dir / "dirwalk", src)
+    dw = DirectoryWalker(src, dst)
+
+    report = dw.createFilteredData(_copy_or_fail, workers=2, incremental=True)
+    assert report.count == 8 and report.skipped == 0 and len(report.errors) == 1
+
+    os.utime(src / "1" / "random.png", ns=(0, 0))  # touch one source
+    report = dw.createFilteredData(_copy_or_fail, workers=2, incremental=True)
+    # changed file and the failed one are processed again
+    assert report.count == 2 and report.skipped == 6
+
+    report = dw.createFilteredData(
+        _copy_or_fail, workers=2, incremental=True, version=2
+    )
+    assert report.count == 8
+    for count in [8, 1]:  # tuple versions match their JSON list form
+        report = dw.createFilteredData(
+            _copy_or_fail, workers=2, incremental=True, version=(3, "a")
+        )
+        assert report.count == count and report.skipped == 8 - count
+    print(f"incremental: reruns only process changed sources")
+
+
+def _read_bytes(ifile):
+    with open(ifile, "rb") as fh:
+        return fh.read()
+
+
+def _write_bytes(ofile, data):
+    with open(ofile, "wb") as fh:
+        fh.write(data)
+
+
+def _test_pipelined():
+    dw = DirectoryWalker(test_data_dir / "dirwalk", out_dir / "dirwalk_pipelined")
+    report = dw.createPipelinedData(_copy_or_fail, prefetch=4, max_writes=2)
+    assert report.count == 8 and len(report.errors) == 1
+    report = dw.createPipelinedData(
+        lambda data: data[::-1], read=_read_bytes, write=_write_bytes
+    )
+    assert report.ok() and report.count == 8
+    for stages in [{"read": _read_bytes}, {"write": _write_bytes}]:
+        try:
+            dw.createPipelinedData(lambda data: data, **stages)
+        except ValueError:
+            continue
+        raise AssertionError(f"createPipelinedData accepted only {list(stages)}")
+    print(f"pipelined: {report.count} files read, filtered and written")
+
+
+def _test_progress():
+    lines = []
+    meter = ProgressMeter("Filtering", interval=0, output=False, callback=lines.append)
+    fl = filter_directory(test_data_dir / "dirwalk", None, print_progress=meter)
+    assert meter.files == len(fl) and len(lines) == len(fl) + 1  # + final report
+
+    dw = DirectoryWalker(test_data_dir / "dirwalk", out_dir / "dirwalk_progress")
+    report = dw.createFilteredData(_copy_or_fail, workers=2, print_progress=False)
+    assert report.summary.bytes == 0  # silent runs do not measure sizes
+    meter = ProgressMeter("Copying", output=False)
+    report = dw.createFilteredData(_copy_or_fail, workers=2, print_progress=meter)
+    summary = report.summary.asDict()
+    assert summary["files"] == 8 and summary["errors"] == 1 and summary["bytes"] > 0
+    print(f"progress: {report.summary}")
+
+
+def _test_shards():
+    root = test_data_dir / "dirwalk"
+    shards = [
+        filter_directory(root, None, shard_index=i, shard_count=3) for i in range(3)
+    ]
+    assert sorted(sum(shards, [])) == sorted(filter_directory(root, None))
+
+    for i in range(3):
+        dw = DirectoryWalker(root, out_dir / "dirwalk_shards", i, 3)
+        report = dw.createFilteredData(_copy_or_fail, incremental=True, workers=2)
+        assert report.count == len(shards[i])
+    copied = filter_directory(out_dir / "dirwalk_shards", FileFilter().compile())
+    assert len(copied) == len(sum(shards, [])) - 1 + 3  # one error, 3 manifests
+    for cache_dir in [None, out_dir / "cache"]:
+        try:
+            filter_directory(
+                root, None, cache_dir=cache_dir, shard_index=7, shard_count=3
+            )
+            assert False, "invalid shard accepted"
+        except ValueError:
+            pass
+    try:
+        iter_directory(root, None, shard_index=-1, shard_count=3)
+        assert False, "invalid shard accepted"
+    except ValueError:
+        pass
+    print(f"shards: {[len(s) for s in shards]} files")
+
+
+class _GroupCounter:
+    def __call__(self, ifiles, structure):
+        return [os.path.basename(i) for i in ifiles]
+
+
+def _test_grouper():
+    ff = FileFilter()
+    ff.setValidExtensions(["png", "xml"])
+    ff.setValidSuffixes(["_PARTS", "_PARTS_BB", "_ST"])
+    grouper = FileGrouper(ff)
+    names = ["X_ST.png", "X_PARTS_BB.xml", "Y_ST.png", "X_PARTS.png", "X.png"]
+    complete, incomplete = grouper.groups(names)
+    assert complete == [["X_PARTS.png", "X_PARTS_BB.xml", "X_ST.png"]]
+    assert incomplete == [["Y_ST.png"]]
+
+    src = out_dir / "dirwalk_groups"
+    shutil.rmtree(src, ignore_errors=True)
+    os.makedirs(src / "a")
+    for name in names:
+        with open(src / "a" / name, "wb"):
+            pass
+    dw = DirectoryWalker(src, out_dir / "dirwalk_groups_out")
+    report = dw.run(_GroupCounter(), multiple=True, grouper=grouper)
+    assert [r for _, r in report.results] == complete
+    assert len(report.incomplete) == 1
+    print(f"grouper: {len(complete)} complete, {len(incomplete)} incomplete group(s)")
+
+
+def _test_duplicates():
+    root = out_dir / "dirwalk_duplicates"
+    shutil.rmtree(root, ignore_errors=True)
+    shutil.copytree(test_data_dir / "dirwalk", root)
+    shutil.copy(root / "3" / "gray.png", root / "1" / "gray_copy.png")
+    data = bytes(200000)
+    for name, tail in [("a.bin", b"1"), ("b.bin", b"1"), ("c.bin", b"2")]:
+        with open(root / name, "wb") as fh:
+            fh.write(data + tail)  # identical heads
+
+    groups = find_duplicates(root, head_size=4096, workers=4)
+    assert [[os.path.basename(f) for f in g] for g in groups] == [
+        ["gray_copy.png", "gray.png"],
+        ["a.bin", "b.bin"],
+    ]
+    print(f"duplicates: {len(groups)} groups found")
+
+
 def test():
     printPreamble(__file__)
 
     _test_filter()
+    _test_iter()
+    _test_file_filter()
+    _test_index()
     _test_walker()
+    _test_parallel()
+    _test_incremental()
+    _test_pipelined()
+    _test_progress()
+    _test_shards()
+    _test_grouper()
+    _test_duplicates()
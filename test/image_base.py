@@ -1,4 +1,6 @@
 import cv2
+import time
+import tracemalloc
 from mbeex.image.io import *
 from mbeex.image.base import *
 from test import *
@@ -69,9 +71,231 @@ def _test_colormap():
     print(f"colormap: colormapped grayscale image")
 
 
+def _test_overlay_buffers():
+    img = create_mono_colored_image(src_size, 3, (0, 200, 0))
+    trafo, w, h = transformation_from_angle(img, 0.3)
+    bg = create_noisy_image([h, w], 3, rng=np.random.default_rng(1))
+    reference = create_noisy_image([h, w], 3, rng=np.random.default_rng(1))
+    mask = create_transformed_rect_mask(src_size, trafo, [h, w], cv2.INTER_NEAREST)
+    top = cv2.warpAffine(img, trafo, (w, h), flags=cv2.INTER_NEAREST)
+    reference[mask > 0] = top[mask > 0]
+    assert overlay_transformed_image(img, bg, trafo) is bg and (bg == reference).all()
+
+    tracemalloc.start()
+    for _ in range(10):
+        overlay_transformed_image(img, bg, trafo)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    assert peak < bg.nbytes // 10
+    print(f"overlay: steady state peak allocation {peak} bytes")
+
+
+def _test_transform_cache():
+    img = create_noisy_image(src_size, 3)
+    cache = TransformCache()
+    previous = set_transform_cache(cache)
+    try:
+        for _ in range(2):
+            for angle in [0.1, 0.5]:
+                trafo, w, h = transformation_from_angle(img, angle)
+                trafo[0, 2] += 3
+                top = cv2.warpAffine(
+                    img, trafo, (w + 3, h + 7), flags=cv2.INTER_NEAREST
+                )
+                result = overlay_on_noisy_background(img, angle, dx0=3, dy1=7)
+                _, _, mask = rotated_rect_mask(src_size, angle, dx0=3, dy1=7)
+                assert not mask.flags.writeable and result.shape == top.shape
+                assert (result[mask > 0] == top[mask > 0]).all()
+        stats = cache.stats()
+        assert stats["entries"] == 2 and stats["misses"] == 2 and stats["hits"] == 6
+        cache.max_bytes = 1
+        rotated_rect_mask(src_size, 0.7)
+        assert cache.stats()["entries"] == 2  # too large for the budget
+    finally:
+        set_transform_cache(previous)
+    print(f"transform cache: {stats}")
+
+
+def _test_overlay_batch():
+    img = create_noisy_image([60, 80], 3)
+    angles = [0.0, 0.3, 0.3, -1.2]
+    offsets = [(0, 0, 0, 0), (5, 0, 0, 5), (5, 0, 0, 5), (0, 2, 0, 0)]
+    batch, seeds = overlay_batch_on_noisy_background(img, angles, offsets, seed=7)
+    again, _ = overlay_batch_on_noisy_background(img, angles, offsets, seed=7)
+    assert (batch == again).all() and batch.shape[0] == 4
+    n, height, width, _ = batch.shape
+    for i, (angle, (dx0, dy0, dx1, dy1)) in enumerate(zip(angles, offsets)):
+        _, w, h = transformation_from_angle(img, angle)
+        dx1 += width - (w + dx0 + dx1)
+        dy1 += height - (h + dy0 + dy1)
+        rng = np.random.default_rng(seeds[i])
+        sample = overlay_on_noisy_background(img, angle, dx0, dy0, dx1, dy1, rng=rng)
+        assert (sample == batch[i]).all()
+    print(f"overlay batch: {batch.shape}, samples reproducible from seeds")
+
+
+def _full_canvas_overlay(top, bg, trafo, flags=cv2.INTER_NEAREST):
+    h, w = image_size(bg)
+    white = np.full(image_size(top), 255, np.uint8)
+    mask = cv2.warpAffine(white, trafo, (w, h), flags=flags) > 0
+    warped = cv2.warpAffine(top, trafo, (w, h), flags=flags).reshape(bg.shape)
+    return np.where(mask.reshape(mask.shape + (1,) * (bg.ndim - 2)), warped, bg)
+
+
+def _test_overlay_box():
+    top = create_noisy_image([40, 30], 3)
+    bg = create_noisy_image([600, 800], 3)
+    trafo = cv2.getRotationMatrix2D((15, 20), 33, 1.5)
+    trafo[:, 2] += (500, 200)
+    reference = _full_canvas_overlay(top, bg, trafo)
+    assert (overlay_transformed_image(top, bg, trafo) == reference).all()
+    # random patches of all image types (OpenCV selects pixels differently
+    # for some of them, these are warped on the full canvas)
+    rng = np.random.default_rng(0)
+    types = [(np.uint8, 3), (np.uint8, 0), (np.uint16, 4), (np.float32, 1)]
+    types += [(np.uint8, 2), (np.int16, 3), (np.float64, 3)]
+    for i in range(300):
+        dtype, channels = types[i % len(types)]
+        h, w = rng.integers(2, 120, 2)
+        shape = (h, w, channels) if channels else (h, w)
+        top = rng.integers(1, 250, shape).astype(dtype)
+        bg = np.zeros((300, 400) + shape[2:], dtype)
+        angle = rng.choice([rng.uniform(-180, 180), 0, 45, 90, 180])
+        trafo = cv2.getRotationMatrix2D((w / 2, h / 2), angle, rng.uniform(0.3, 3))
+        trafo[:, 2] += rng.uniform(-50, 450), rng.uniform(-50, 350)
+        reference = _full_canvas_overlay(top, bg, trafo)
+        assert (overlay_transformed_image(top, bg, trafo) == reference).all()
+    # masks of all interpolations, also with inverted transformation
+    trafo = cv2.getRotationMatrix2D((15, 20), 33, 1.5)
+    trafo[:, 2] += (50, 80)
+    inverse = cv2.invertAffineTransform(trafo)
+    white = np.full((40, 30), 255, np.uint8)
+    for interpolation in [cv2.INTER_NEAREST, cv2.INTER_LINEAR, cv2.INTER_CUBIC]:
+        for m, flags in [
+            (trafo, interpolation),
+            (inverse, interpolation | cv2.WARP_INVERSE_MAP),
+        ]:
+            mask = cv2.warpAffine(white, m, (400, 300), flags=flags)
+            reference = (mask > 0).astype(np.uint8) * 255
+            result = create_transformed_rect_mask((40, 30), m, (300, 400), flags)
+            assert (result == reference).all() and result.any(), flags
+    print(f"overlay: bounding box compositing identical to full canvas warps")
+
+
+def _baseline_overlay(top, bg, trafo, flags=cv2.INTER_NEAREST):
+    h, w = image_size(bg)
+    white = np.full(image_size(top), 255, np.uint8)
+    mask = cv2.warpAffine(white, trafo, (w, h), flags=flags)
+    cv2.copyTo(cv2.warpAffine(top, trafo, (w, h), flags=flags), mask, bg)
+    return bg
+
+
+def _best_times(*funcs, repeat=10):
+    times = [[] for _ in funcs]
+    for _ in range(repeat):  # interleaved, so that all see the same load
+        for func, t in zip(funcs, times):
+            t0 = time.perf_counter()
+            func()
+            t.append(time.perf_counter() - t0)
+    return [min(t) for t in times]
+
+
+def _test_overlay_timing():
+    rng = np.random.default_rng(9)
+    angle = 0.3
+    trafo = np.float32(
+        [[np.cos(angle), -np.sin(angle), 100], [np.sin(angle), np.cos(angle), 50]]
+    )
+    bg = rng.integers(0, 256, (2000, 3000, 3), np.uint8)
+    for size, speedup in [(64, 10), (512, 1.5), (1500, 0.7)]:
+        top = rng.integers(0, 256, (size, size, 3), np.uint8)
+        base, box = _best_times(
+            lambda: _baseline_overlay(top, bg, trafo),
+            lambda: overlay_transformed_image(top, bg, trafo),
+        )
+        print(
+            f"overlay timing: {size}x{size} on {bg.shape[1]}x{bg.shape[0]}: "
+            f"{box * 1e3:.2f} ms (full canvas {base * 1e3:.2f} ms)"
+        )
+        assert box * speedup < base
+    top = rng.integers(0, 256, (512, 512, 3), np.uint8)
+    bg = bg[:641, :641]
+    base, box = _best_times(
+        lambda: _baseline_overlay(top, bg, trafo),
+        lambda: overlay_transformed_image(top, bg, trafo),
+    )
+    print(
+        f"overlay timing: 512x512 on 641x641: "
+        f"{box * 1e3:.2f} ms (full canvas {base * 1e3:.2f} ms)"
+    )
+    assert box < 1.5 * base
+
+
+def _test_overlay_cache_timing():
+    rng = np.random.default_rng(10)
+    cache = TransformCache()
+    previous = set_transform_cache(cache)
+    try:
+        for size, offset in [(512, 0), (64, 1000)]:
+            img = rng.integers(0, 256, (size, size, 3), np.uint8)
+
+            def baseline():
+                trafo, w, h = transformation_from_angle(img, 0.3)
+                trafo[0, 2] += offset
+                size = (h + offset, w + offset)
+                bg = create_noisy_image(size, 3, out=out, rng=rng)
+                return _baseline_overlay(img, bg, trafo)
+
+            def cached():
+                return overlay_on_noisy_background(
+                    img, 0.3, dx0=offset, dy1=offset, out=out, rng=rng
+                )
+
+            out = None
+            out = cached()  # fill the cache, same output buffer for both
+            base, hit = _best_times(baseline, cached)
+            print(
+                f"overlay timing: noisy background, {size}x{size} cache hit "
+                f"{hit * 1e3:.2f} ms (uncached full canvas {base * 1e3:.2f} ms)"
+            )
+            assert hit < base
+    finally:
+        set_transform_cache(previous)
+
+
+def _reference_colormap(img, name):
+    import matplotlib.pyplot as plt
+    import matplotlib.colors as mcol
+
+    cmap = plt.get_cmap(name)
+    colors = [(0.0, 0.0, 0.0, 1.0)] + [cmap(i) for i in range(1, cmap.N)]
+    rgb = (mcol.ListedColormap(colors, "ref", cmap.N)(img) * 2**16).astype(np.uint16)
+    return cv2.cvtColor(rgb[:, :, :3], cv2.COLOR_RGB2BGR)
+
+
+def _test_colormap_lut():
+    rng = np.random.default_rng(0)
+    for dtype in [np.uint8, np.uint16]:
+        img = rng.integers(0, np.iinfo(dtype).max, src_size, dtype=dtype, endpoint=True)
+        for name in ["PuBuGn", "tab10"]:
+            assert (
+                colormapped_image(img, name) == _reference_colormap(img, name)
+            ).all()
+    out = np.empty(img.shape + (3,), np.uint8)
+    assert colormapped_image(img, "jet", np.uint8, out=out) is out
+    print(f"colormap: lookup tables match matplotlib mapping")
+
+
 def test():
     printPreamble(__file__)
     _test_mask()  # creating masked image
     _test_transformed_mask()  # creating transformed rectangular mask
     _test_overlay()  # overlay image with transformed 2nd image
     _test_colormap()  # false color creation from matplotlib color map
+    _test_colormap_lut()  # cached lookup tables
+    _test_overlay_buffers()  # in place overlay with pooled buffers
+    _test_transform_cache()  # memoized rotations and masks
+    _test_overlay_batch()  # batched augmentation
+    _test_overlay_box()  # compositing restricted to the bounding box
+    _test_overlay_timing()  # cost scales with the patch size
+    _test_overlay_cache_timing()  # cached masks and warp maps
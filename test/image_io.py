@@ -1,3 +1,5 @@
+import os
+import shutil
 from mbeex.image.base import *
 from mbeex.image.io import *
 from test import *
@@ -39,7 +41,124 @@ def _test_read():
     _r("noise_gray", 1)
 
 
+def _test_read_images():
+    names = [_i[n] for n in onames] + [str(out_dir / "missing.png")]
+    errors = []
+    imgs = list(read_images(names, workers=2, prefetch=2, errors=errors))
+    assert [f for f, _ in imgs] == names[:-1] and len(errors) == 1
+    imgs = dict(read_images(names[:-1], ordered=False, enforce_color=True))
+    assert all(img.shape[2] == 3 for img in imgs.values())
+    print(f"read_images: {len(imgs)} images read, 1 unreadable file reported")
+
+
+def _test_cache():
+    cache = ImageCache(max_bytes=2 * 200 * 300 * 4)
+    old = set_image_cache(cache)
+    try:
+        for _ in range(3):
+            img = read_image(_i["color_with_alpha"])
+        assert not img.flags.writeable
+        read_image(_i["color"])
+        read_image(_i["noise_color"])  # evicts "color_with_alpha"
+        assert read_image(_i["gray"], cache=False) is not None  # bypassed
+    finally:
+        set_image_cache(old)
+    stats = cache.stats()
+    assert stats["hits"] == 2 and stats["misses"] == 3 and stats["evictions"] == 1
+    print(f"cache: {stats}")
+
+
+def _test_reduced():
+    img = read_image(_i["noise_color"], reduce=4, enforce_color=True)
+    assert image_size(img) == (src_size[0] // 4, src_size[1] // 4)
+    img = read_image(_i["color_with_alpha"], reduce=16)  # keeps alpha
+    assert img.shape == (-(-src_size[0] // 16), -(-src_size[1] // 16), 4)
+    img = read_image(_i["noise_gray"], roi=[10, 20, 110, 70])
+    assert image_size(img) == (50, 100) and img.base is None
+    img = read_image(_i["noise_gray"], reduce=2, roi=[10, 20, 110, 70])
+    assert image_size(img) == (25, 50)
+    img = read_image(_i["noise_gray"], roi=[-10, -10, 50, 50])  # clipped
+    assert image_size(img) == (50, 50)
+    fname = out_dir / "odd.jpg"
+    write_image(fname, create_noisy_image((201, 301), 3))
+    for enforce_color in [True, False]:
+        img = read_image(fname, enforce_color, reduce=2)
+        assert image_size(img) == (101, 151)  # rounded up like OpenCV
+    for kwargs in [{"reduce": 0}, {"roi": [500, 500, 600, 600]}]:
+        try:
+            read_image(_i["noise_gray"], **kwargs)
+        except ValueError:
+            continue
+        raise AssertionError(f"read_image accepted {kwargs}")
+    print(f"reduced: thumbnails and ROI decoded")
+
+
+def _test_probe():
+    for name in onames:
+        img = read_image(_i[name])
+        info = probe_image(_i[name])
+        channels = 1 if img.ndim == 2 else img.shape[2]
+        assert (info.height, info.width, info.channels) == img.shape[:2] + (channels,)
+    # JPEG and TIFF headers, also 16 bit images
+    probe_dir = out_dir / "probe"
+    os.makedirs(probe_dir, exist_ok=True)
+    gray16 = create_noisy_image(src_size, 1).astype(np.uint16) * 257
+    for name, img in [
+        ("gray.jpg", create_noisy_image(src_size, 1)),
+        ("color.jpg", create_noisy_image(src_size, 3)),
+        ("gray.tif", create_noisy_image(src_size, 1)),
+        ("color.tif", create_noisy_image(src_size, 3)),
+        ("color_with_alpha.tiff", create_noisy_image(src_size, 4)),
+        ("gray16.tif", gray16),
+        ("gray16.png", gray16),
+    ]:
+        write_image(probe_dir / name, img)
+        img = read_image(probe_dir / name)
+        info = probe_image(probe_dir / name)
+        channels = 1 if img.ndim == 2 else img.shape[2]
+        shape = img.shape[:2] + (channels, img.dtype.itemsize * 8)
+        assert (info.height, info.width, info.channels, info.depth) == shape, name
+    print(f"probe: {probe_image(_i['color_with_alpha'])}")
+
+
+def _test_image_index():
+    from mbeex.image.index import ImageIndex
+
+    root = out_dir / "index"  # only the images written here
+    os.makedirs(root, exist_ok=True)
+    for name in onames:
+        shutil.copy(_i[name], root)
+    with ImageIndex(root, cache_dir=out_dir / "cache") as index:
+        assert index.update() == len(onames) and index.update() == 0
+        found = index.query("channels = ? AND width >= 300", 4)
+    assert [f for f, _ in found] == [str(root / "color_with_alpha.png")]
+    print(f"image index: {found[0][1]}")
+
+
+def _test_writer():
+    img = create_noisy_image(src_size, 3)
+    with ImageWriter(workers=2, max_pending=2, png_compression=1) as writer:
+        for i in range(6):
+            writer.write(out_dir / "writer" / f"noise_{i}.png", img)
+        writer.write(out_dir / "writer" / "noise.jpg", img)
+    assert (read_image(out_dir / "writer" / "noise_5.png") == img).all()
+
+    writer = ImageWriter()
+    writer.write(out_dir / "writer" / "noise.unknown_format", img)
+    try:
+        writer.close()
+        assert False, "write error not reported"
+    except ImageException as e:
+        print(f"writer: 7 images written, error reported: {e}")
+
+
 def test():
     printPreamble(__file__)
     _test_write()  # writing images to file
     _test_read()  # reading images from file
+    _test_read_images()  # concurrent reading
+    _test_cache()  # decoded image cache
+    _test_reduced()  # reduced resolution and ROI
+    _test_probe()  # header only image properties
+    _test_image_index()  # persistent image property index
+    _test_writer()  # asynchronous writing
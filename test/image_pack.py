@@ -0,0 +1,51 @@
+from mbeex.base.directory import *
+from mbeex.image.base import *
+from mbeex.image.io import *
+from mbeex.image.pack import *
+from test import *
+
+
+def _test_pack():
+    root = test_data_dir / "dirwalk"
+    pack_file = out_dir / "dirwalk.pack"
+    os.makedirs(out_dir, exist_ok=True)
+    n = pack_images(root, pack_file)
+    pack = PackedImages(pack_file)
+    assert len(pack) == n == count_files(root)
+    for i, name in enumerate(pack.names):
+        img = read_image(root / name)
+        assert (pack[i] == img).all() and not pack[i].flags.writeable
+    print(f"pack: {n} images packed into {os.path.getsize(pack_file)} bytes")
+
+
+def _test_batch():
+    root = out_dir / "uniform"
+    os.makedirs(root, exist_ok=True)
+    for i in range(4):
+        write_image(root / f"{i}.png", create_noisy_image([30, 17], 3))
+    pack_file = out_dir / "uniform.pack"
+    pack_images(root, pack_file, FileFilter().compile())
+    pack = PackedImages(pack_file)
+    batch = pack.batch(1, 4)
+    assert batch.shape == (3, 30, 17, 3)
+    assert (batch[1] == pack[2]).all() and batch.base is not None  # view
+    batch = pack.batch(-2, len(pack))  # negative start
+    assert batch.shape == (2, 30, 17, 3) and (batch[0] == pack[2]).all()
+    print(f"pack: batch view {batch.shape}")
+
+
+def _test_empty():
+    root = out_dir / "empty"
+    os.makedirs(root, exist_ok=True)
+    pack_file = out_dir / "empty.pack"
+    assert pack_images(root, pack_file) == 0
+    pack = PackedImages(pack_file)
+    assert len(pack) == 0 and pack[:] == []
+    print(f"pack: empty pack")
+
+
+def test():
+    printPreamble(__file__)
+    _test_pack()  # pack directory tree, read back
+    _test_batch()  # zero-copy batch view
+    _test_empty()  # pack without images
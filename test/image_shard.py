@@ -0,0 +1,41 @@
+from mbeex.base.directory import *
+from mbeex.image.io import *
+from mbeex.image.shard import *
+from test import *
+
+
+def _test_shards(format):
+    root = test_data_dir / "dirwalk"
+    dst = out_dir / f"shards_{format}"
+    shards = write_shards(root, dst, format=format, max_files=3)
+    n = count_files(root)
+    assert len(shards) == -(-n // 3)
+    read = 0
+    for shard in shards:
+        for name, img in read_shard(shard, workers=2):
+            assert (img == read_image(root / name)).all()
+            read += 1
+    assert read == n
+    print(f"shards: {n} images in {len(shards)} {format} shards")
+
+
+def _test_split():
+    root = test_data_dir / "dirwalk"
+    names = []
+    for i in range(2):
+        for shard in write_shards(
+            root, out_dir / "shards_split", shard_index=i, shard_count=2
+        ):
+            names += [name for name, _ in read_shard(shard, reduce=2)]
+    assert sorted(names) == sorted(
+        os.path.relpath(f, root).replace(os.sep, "/")
+        for f in filter_directory(root, None)
+    )
+    print(f"shards: {len(names)} images in 2 walker shards")
+
+
+def test():
+    printPreamble(__file__)
+    _test_shards("tar")  # write tar shards, read back
+    _test_shards("zip")  # write zip shards, read back
+    _test_split()  # distributed shard writing
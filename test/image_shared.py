@@ -0,0 +1,58 @@
+import concurrent.futures
+from mbeex.image.base import *
+from mbeex.image.shared import *
+from test import *
+
+
+def _invert(src, dst):
+    with attach_image(src) as img, attach_image(dst) as out:
+        np.subtract(255, img, out=out)
+    return src.name
+
+
+def _test_exchange():
+    imgs = [create_noisy_image(src_size, 3) for _ in range(4)]
+    with SharedImagePool() as pool, concurrent.futures.ProcessPoolExecutor(2) as ex:
+        for _ in range(3):
+            jobs = []
+            for img in imgs:
+                src = pool.put(img)
+                dst = pool.allocate(img.shape, img.dtype)
+                jobs.append((src, dst, ex.submit(_invert, src, dst)))
+            for (src, dst, job), img in zip(jobs, imgs):
+                assert job.result() == src.name
+                pool.release(src)
+                assert (pool.get(dst) == 255 - img).all()
+        assert pool.created == 8 and pool.reused == 16
+    try:
+        with attach_image(src):
+            assert False, "block not unlinked"
+    except FileNotFoundError:
+        pass
+    print(f"shared: {pool.created} blocks created, {pool.reused} reused")
+
+
+def _raises(func, *args):
+    try:
+        func(*args)
+    except ImageException:
+        return True
+    return False
+
+
+def _test_misuse():
+    img = create_noisy_image(src_size, 3)
+    with SharedImagePool() as pool, SharedImagePool() as other:
+        handle = pool.put(img)
+        assert (pool.get(handle) == img).all()
+        assert _raises(pool.release, handle)  # released by get
+        assert pool.put(img) == handle and pool.put(img) != handle
+        assert _raises(other.release, handle)
+    assert _raises(pool.put, img) and _raises(pool.allocate, img.shape)
+    print(f"shared: double release, foreign handles and closed pool rejected")
+
+
+def test():
+    printPreamble(__file__)
+    _test_exchange()  # process pool round trip, block reuse, cleanup
+    _test_misuse()  # invalid releases, allocation after close
@@ -0,0 +1,54 @@
+import os
+import time
+import cv2
+from mbeex.image.base import *
+from mbeex.image.stream import *
+from test import *
+
+
+def _write_video(fname, frames):
+    os.makedirs(out_dir, exist_ok=True)
+    writer = cv2.VideoWriter(
+        str(fname), cv2.VideoWriter_fourcc(*"MJPG"), 25, tuple(src_size[::-1])
+    )
+    assert writer.isOpened()
+    for i in range(frames):
+        img = create_noisy_image(src_size, 3)
+        cv2.putText(img, str(i), (20, 100), cv2.FONT_HERSHEY_SIMPLEX, 2, (0, 0, 0), 5)
+        writer.write(img)
+    writer.release()
+
+
+def _gray(img):
+    return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+
+def _test_stages():
+    fname = out_dir / "stream.avi"
+    _write_video(fname, 30)
+    stream = VideoStream(fname, buffer_size=4)
+    stream.addStage(_gray).addStage(lambda img: find_contours(img, 128), "contours", 2)
+    with stream:
+        indices = [frame.index for frame in stream]
+    assert sorted(indices) == list(range(30)) and not stream.errors
+    stats = stream.stats()
+    assert [stats[s]["files"] for s in ("decode", "_gray", "contours")] == [30] * 3
+    print(f"stream: 30 frames, {stats['contours']['files_per_s']:.1f} fps (contours)")
+
+
+def _test_drop():
+    stream = VideoStream(out_dir / "stream.avi", buffer_size=2, drop_oldest=True)
+    with stream:
+        frames = []
+        for frame in stream:
+            time.sleep(0.01)  # slow consumer
+            frames.append(frame.index)
+    dropped = stream.stats()["decode"]["dropped"]
+    assert dropped > 0 and len(frames) + dropped == 30 and frames == sorted(frames)
+    print(f"stream: {dropped} of 30 frames dropped by slow consumer")
+
+
+def test():
+    printPreamble(__file__)
+    _test_stages()  # decode thread, chained stages
+    _test_drop()  # drop-oldest back pressure policy
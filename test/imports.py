@@ -0,0 +1,44 @@
+import json
+import subprocess
+import sys
+from test import *
+
+# modules, which must not be loaded by importing the core modules
+heavy_modules = ["matplotlib", "torch", "PyQt5"]
+
+_probe = """
+import json, sys, time
+t0 = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - t0
+heavy = [m for m in {heavy!r} if m in sys.modules]
+print(json.dumps([elapsed, heavy]))
+"""
+
+
+def _import_time(module):
+    """Import time (s) of `module` in a fresh interpreter and loaded heavy modules"""
+
+    out = subprocess.run(
+        [sys.executable, "-c", _probe.format(module=module, heavy=heavy_modules)],
+        cwd=root,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return json.loads(out.splitlines()[-1])
+
+
+def _test_import_times():
+    for module in ["mbeex.base.directory", "mbeex.image.io", "mbeex.image.region"]:
+        best = None
+        for _ in range(3):
+            elapsed, heavy = _import_time(module)
+            assert not heavy, f"{module} imports {heavy}"
+            best = elapsed if best is None else min(best, elapsed)
+        print(f"import {module}: {best * 1000:.0f}ms")
+
+
+def test():
+    printPreamble(__file__)
+    _test_import_times()  # no heavy optional dependencies at import time
@@ -1,15 +1,25 @@
 import base
+import imports
 import image_io
 import image_base
 import image_region
+import image_pack
+import image_shard
+import image_shared
+import image_stream
 import pytorch
 
 
 def main():
     base.test()
+    imports.test()
     image_io.test()
     image_base.test()
     image_region.test()
+    image_pack.test()
+    image_shard.test()
+    image_shared.test()
+    image_stream.test()
     pytorch.test()
 
 